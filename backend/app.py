@@ -18,6 +18,8 @@ if os.path.exists(dotenv_local_path):
     load_dotenv(dotenv_local_path, override=True)
     logging.info(f"Loaded config from {dotenv_local_path}")
 
+from core.json_provider import OrjsonProvider
+
 # Import Blueprints
 from features.common.routes import common_bp
 from features.knowledge.routes import knowledge_bp
@@ -58,6 +60,11 @@ logging.basicConfig(level=logging.INFO,
 
 def create_app():
     app = Flask(__name__)
+    app.json = OrjsonProvider(app)
+    # Cap for in-memory non-file form fields; file parts go to Werkzeug's spooled temp files
+    app.config['MAX_FORM_MEMORY_SIZE'] = 1024 * 1024
+    # Behind Apache mod_xsendfile / lighttpd: send_file(path) only emits X-Sendfile and the proxy streams the file
+    app.config['USE_X_SENDFILE'] = os.getenv("USE_X_SENDFILE") == "1"
     CORS(app)
 
     # Register Blueprints
@@ -348,7 +348,7 @@ def canvas_chat():
         if intent == "MODIFY":
             if code:
                 # Execute Code on STAGING
-                success, error_msg = current_engine.execute_code(code)
+                success, error_msg, _ = current_engine.execute_code(code)
                 
                 if not success:
                      # If execution fails, return error in reply and downgrade to CHAT
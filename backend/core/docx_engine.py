@@ -5,6 +5,8 @@ import os
 import re
 import logging
 import hashlib
+import itertools
+import zipfile
 from docx import Document
 from docx.text.paragraph import Paragraph
 from docx.table import Table
@@ -22,7 +24,26 @@ if not os.path.isabs(log_path):
 logging.basicConfig(filename=log_path, level=logging.INFO, 
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Unique id stamped on each loaded reference, used to fingerprint the reference set
+_REF_UIDS = itertools.count(1)
+
+def package_etag(path_or_stream) -> str:
+    """
+    ETag for a saved .docx (path or stream), built from each part's name, CRC and size.
+    Hashing the raw bytes would change on every save because zip entries carry timestamps.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    with zipfile.ZipFile(path_or_stream) as zf:
+        for info in zf.infolist():
+            hasher.update(f"{info.filename}:{info.CRC}:{info.file_size};".encode())
+    if hasattr(path_or_stream, "seek"):
+        path_or_stream.seek(0)
+    return hasher.hexdigest()
+
 class DocxEngine:
+    # Paragraphs returned after a mutation; further pages come from /preview and /preview_html
+    PREVIEW_PAGE_SIZE = 100
+
     def __init__(self):
         self.doc = None
         self.staging_doc = None # Temporary document for previews
@@ -35,9 +56,14 @@ class DocxEngine:
             'preview_data': None,   # Cached paragraph preview
             'toc': None,            # Cached table of contents
             'full_text': None,      # Cached full text extraction
-            'reference_hashes': {}  # Track reference doc hashes
+            'reference_hashes': {}, # Track reference doc hashes
+            'reference_toc': None   # (reference fingerprint, combined TOC)
         }
         self._modified_paras = set()  # Track modified paragraphs for incremental save
+        # Document revision: bumped by touch() on every mutation. Preview/structure
+        # results are memoized per (revision, view, args) in _view_cache.
+        self._rev = 0
+        self._view_cache = {}
         
         # Persistence: Try to reload last canvas
         self._try_reload_last_canvas()
@@ -59,9 +85,11 @@ class DocxEngine:
 
     def load_document(self, file_stream):
         """Load document with MD5-based caching to avoid redundant parsing"""
-        # Read content for MD5 calculation
-        content = file_stream.read()
-        file_hash = hashlib.md5(content).hexdigest()
+        # Hash in chunks so large (possibly disk-spooled) uploads are never held in memory twice
+        hasher = hashlib.md5()
+        for chunk in iter(lambda: file_stream.read(1024 * 1024), b""):
+            hasher.update(chunk)
+        file_hash = hasher.hexdigest()
         
         # Check cache
         if self._cache['file_hash'] == file_hash and self.doc is not None:
@@ -72,7 +100,8 @@ class DocxEngine:
         
         # Cache miss - parse document
         logging.info(f"[Cache MISS] Parsing DOCX (hash: {file_hash[:8]}...)")
-        self.doc = Document(io.BytesIO(content))
+        file_stream.seek(0)
+        self.doc = Document(file_stream)
         self.staging_doc = None
         
         # Update cache
@@ -84,8 +113,83 @@ class DocxEngine:
         self.reference_docs = []
         return self.doc
     
+    def touch(self):
+        """
+        Marks the active document as modified so cached previews are rebuilt.
+        Call this after editing doc/staging_doc directly instead of through the engine.
+        """
+        self._rev += 1
+        self._view_cache.clear()
+
+    def _cached_view(self, key: tuple, build):
+        # Key is taken before building, so a result raced by touch() lands under a stale revision
+        cache_key = (self._rev,) + key
+        if cache_key in self._view_cache:
+            return self._view_cache[cache_key]
+        result = build()
+        if len(self._view_cache) >= 64:
+            self._view_cache.clear()
+        self._view_cache[cache_key] = result
+        return result
+
+    def _doc_view(self, doc, name: str, build):
+        """
+        Per-document derived data, built once. Reference docs keep it in their
+        entry for their lifetime; the main/staging doc rebuilds it once per revision.
+        """
+        for ref in self.reference_docs:
+            if ref['doc'] is doc:
+                views = ref.setdefault('views', {})
+                if name not in views:
+                    views[name] = build()
+                return views[name]
+        return self._cached_view((name, id(doc)), build)
+
+    def _paragraph_index(self, doc) -> list:
+        """
+        Paragraph list of *doc*, reused for indexed lookups.
+        doc.paragraphs re-wraps every body element on each access, so indexing it
+        inside a loop is quadratic.
+        """
+        return self._doc_view(doc, "paragraphs", lambda: doc.paragraphs)
+
+    def _paragraph_texts(self, doc) -> list:
+        """Paragraph texts of *doc*, parallel to _paragraph_index (para.text joins runs on every access)."""
+        return self._doc_view(doc, "texts", lambda: [p.text for p in self._paragraph_index(doc)])
+
+    def _start_pages(self, doc) -> list:
+        """
+        start_pages[i] is the page reached after paragraphs[:i], using the same
+        heuristic as the prefix scan _extract_range_with_pages used to repeat per call.
+        """
+        def build():
+            current_page = 1
+            char_count_since_last_page = 0
+            start_pages = [current_page]
+            for p, text in zip(self._paragraph_index(doc), self._paragraph_texts(doc)):
+                old_page = current_page
+                current_page = self._update_page_num(p, current_page, char_count_since_last_page, text=text)
+                
+                if current_page > old_page:
+                    char_count_since_last_page = 0
+                else:
+                    # Heuristic Fallback scan
+                    p_len = len(text)
+                    if p_len > 0:
+                        char_count_since_last_page += p_len
+                    else:
+                        char_count_since_last_page += 50 # Empty line weight
+                        
+                    if char_count_since_last_page > 800: # Consistent with extraction loop
+                        current_page += 1
+                        char_count_since_last_page = 0
+                start_pages.append(current_page)
+            return start_pages
+        return self._doc_view(doc, "start_pages", build)
+
     def _invalidate_cache(self, keys=None):
         """Invalidate specific cache keys or all derived caches"""
+        self.touch()
         if keys is None:
             # Invalidate all derived caches
             self._cache['preview_data'] = None
@@ -104,6 +208,7 @@ class DocxEngine:
             self.doc = Document(f)
         self.original_path = path
         self.staging_doc = None
+        self.touch()
         return self.doc
 
     def load_from_text(self, text: str, preserve_references=False):
@@ -126,6 +231,7 @@ class DocxEngine:
                 self.doc.add_paragraph(line)
         
         self.staging_doc = None
+        self.touch()
         
         # 根据参数决定是否保留参考文档
         if not preserve_references:
@@ -217,6 +323,7 @@ class DocxEngine:
                     
                     # Store as structured reference
                     self.reference_docs.append({
+                        "uid": next(_REF_UIDS),
                         "filename": filename,
                         "type": "excel",
                         "df": df,
@@ -260,6 +367,7 @@ class DocxEngine:
                 markdown_content = None
             
             self.reference_docs.append({
+                "uid": next(_REF_UIDS),
                 "filename": filename,
                 "type": "docx",
                 "doc": ref_doc,
@@ -279,6 +387,7 @@ class DocxEngine:
         self.staging_doc = None
         self.original_path = None
         self.reference_docs = []
+        self.touch()
         
         # Cleanup Logic
         try:
@@ -415,10 +524,23 @@ class DocxEngine:
         """
         return self.get_content_by_toc_items(indices_list)
 
+    def get_reference_fingerprint(self) -> tuple:
+        """
+        Identifies the currently loaded reference set. Changes whenever a
+        reference is added, removed or the list is cleared.
+        """
+        return tuple(ref.get('uid', id(ref)) for ref in self.reference_docs)
+
     def get_reference_structure(self) -> List[Dict[str, Any]]:
         """
         Returns a combined TOC for all reference documents.
+        Cached until the reference set changes.
         """
+        fingerprint = self.get_reference_fingerprint()
+        cached = self._cache['reference_toc']
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+
         combined_toc = []
         
         for doc_idx, ref in enumerate(self.reference_docs):
@@ -438,7 +560,8 @@ class DocxEngine:
                 # We need to make sure LLM can return enough info to identify the doc.
                 # We will handle this by making the "ID" unique in the prompt in llm_engine.
                 combined_toc.append(item)
-                
+
+        self._cache['reference_toc'] = (fingerprint, combined_toc)
         return combined_toc
 
     def get_content_by_toc_items(self, items: List[Dict[str, Any]]) -> str:
@@ -469,12 +592,12 @@ class DocxEngine:
             ref = self.reference_docs[doc_idx]
             doc = ref['doc']
             filename = ref['filename']
-            start = item['start'] # LLM might return 'start' key
-            # In TOC construction we use 'id' as start.
-            if 'id' in item: start = item['id']
+            # TOC items (get_reference_structure) carry 'id'/'end_id'; LLM picks may use 'start'/'end'
+            start = item.get('id', item.get('start'))
+            if start is None:
+                continue
             
-            end = item.get('end', start + 20) # Default
-            if 'end_id' in item: end = item['end_id']
+            end = item.get('end_id', item.get('end', start + 20)) # Default
             
             # Extract
             section_text = self._extract_range_with_pages(doc, start, end)
@@ -488,30 +611,12 @@ class DocxEngine:
         Includes Character-Count Fallback for docs without explicit breaks.
         """
         content = []
-        current_page = 1
-        char_count_since_last_page = 0
+        paragraphs = self._paragraph_index(doc)
+        texts = self._paragraph_texts(doc)
         
-        # 1. Scan to find start page (and establish current page state)
-        for i in range(start_idx):
-             if i >= len(doc.paragraphs): break
-             p = doc.paragraphs[i]
-             
-             old_page = current_page
-             current_page = self._update_page_num(p, current_page, char_count_since_last_page)
-             
-             if current_page > old_page:
-                 char_count_since_last_page = 0
-             else:
-                 # Heuristic Fallback scan
-                 p_len = len(p.text)
-                 if p_len > 0:
-                     char_count_since_last_page += p_len
-                 else:
-                     char_count_since_last_page += 50 # Empty line weight
-                     
-                 if char_count_since_last_page > 800: # Consistent with extraction loop
-                     current_page += 1
-                     char_count_since_last_page = 0
+        # 1. Start page (prefix scan is computed once per document, see _start_pages)
+        scan_to = min(max(start_idx, 0), len(paragraphs))
+        current_page = self._start_pages(doc)[scan_to] if scan_to else 1
              
         content.append(f"[第 {current_page} 页]")
         
@@ -519,19 +624,15 @@ class DocxEngine:
         char_count_since_last_page = 0 
         total_extracted_chars = 0
         
-        for i in range(start_idx, end_idx + 1):
-            if i >= len(doc.paragraphs): break
-            
+        for p, raw_text in zip(paragraphs[start_idx:end_idx + 1], texts[start_idx:end_idx + 1]):
             # Stop if limit reached
             if total_extracted_chars > limit:
                 content.append("\n[...该章节内容过长已只截取部分...]")
                 break
                 
-            p = doc.paragraphs[i]
-            
             # Check for page num update
             old_page = current_page
-            current_page = self._update_page_num(p, current_page, char_count_since_last_page)
+            current_page = self._update_page_num(p, current_page, char_count_since_last_page, text=raw_text)
             
             page_changed = False
             if current_page > old_page:
@@ -539,7 +640,7 @@ class DocxEngine:
                 char_count_since_last_page = 0
                 content.append(f"\n\n[第 {current_page} 页]")
             
-            text = p.text.strip()
+            text = raw_text.strip()
             if text:
                 # Heuristic check
                 if not page_changed:
@@ -578,7 +679,8 @@ class DocxEngine:
             prev_value = value
         return total
 
-    def _update_page_num(self, para, current_page, char_count_since_last_page=0):
+    def _update_page_num(self, para, current_page, char_count_since_last_page=0, text=None):
+        # text: para.text when the caller already has it (saves re-joining the runs)
         # A. Paragraph Property Check (Page Break Before)
         if para.paragraph_format.page_break_before:
              logging.info(f"[Page Debug] Page Break Before detected. {current_page} -> {current_page + 1}")
@@ -628,7 +730,7 @@ class DocxEngine:
         except:
             pass
         
-        p_text = para.text.strip()
+        p_text = (para.text if text is None else text).strip()
         if not p_text: return current_page
 
         # B. Visual Marker
@@ -689,6 +791,10 @@ class DocxEngine:
         return current_page
 
     def get_all_content(self, limit=None) -> str:
+        """Cached per document revision; see _build_all_content."""
+        return self._cached_view(("all_content", limit), lambda: self._build_all_content(limit))
+
+    def _build_all_content(self, limit=None) -> str:
         """
         Retrieves the full content of the current main document with page numbers.
         """
@@ -696,7 +802,7 @@ class DocxEngine:
         if not target_doc: return ""
         
         # Reuse extract logic but for the whole range
-        total_paras = len(target_doc.paragraphs)
+        total_paras = len(self._paragraph_index(target_doc))
         text_content = self._extract_range_with_pages(target_doc, 0, total_paras, limit=limit or 100000)
         
         # Append Table Content
@@ -732,7 +838,8 @@ class DocxEngine:
         for ref in self.reference_docs:
             doc = ref['doc']
             filename = ref['filename']
-            para_count = len(doc.paragraphs)
+            paragraphs = self._paragraph_index(doc)
+            para_count = len(paragraphs)
             
             # --- ADAPTIVE STRATEGY: Small Doc Optimization ---
             if para_count < 300:
@@ -745,12 +852,12 @@ class DocxEngine:
             
             # 1. Build Outline
             outline = []
-            for i, para in enumerate(doc.paragraphs):
+            for i, para in enumerate(paragraphs):
                 if not para.style: continue
                 s_name = para.style.name.lower()
                 if "heading" in s_name or "title" in s_name:
                      outline.append({"index": i, "text": para.text.strip()})
-            outline.append({"index": len(doc.paragraphs), "text": "END"})
+            outline.append({"index": para_count, "text": "END"})
             
             # 2. Identify Sections to Extract
             sections_to_extract = []
@@ -773,7 +880,7 @@ class DocxEngine:
                 hits = []
                 for kw in keywords:
                     # Scan all paragraphs
-                    for i, para in enumerate(doc.paragraphs):
+                    for i, para in enumerate(paragraphs):
                         if kw.lower() in para.text.lower():
                             hits.append(i)
                             if len(hits) > 5: break # Cap matches for performance
@@ -785,7 +892,7 @@ class DocxEngine:
                     matches_found = True
                     for hit_idx in hits:
                         start_window = max(0, hit_idx - 20)
-                        end_window = min(len(doc.paragraphs), hit_idx + 80)
+                        end_window = min(para_count, hit_idx + 80)
                         sections_to_extract.append((start_window, end_window, f"内容深度匹配 (段落 {hit_idx})"))
             
             if sections_to_extract:
@@ -796,7 +903,7 @@ class DocxEngine:
                 # Map paragraph index -> Page Number at the start of that paragraph
                 page_map = {}
                 current_page = 1
-                for i, para in enumerate(doc.paragraphs):
+                for i, para in enumerate(paragraphs):
                     page_map[i] = current_page
                     
                     # A. XML Check
@@ -829,20 +936,20 @@ class DocxEngine:
                 MAX_SECTION_CHARS = 2000
                 
                 for start, end, title in sections_to_extract:
-                    section_content = ""
+                    section_parts = []
                     char_count = 0
                     
                     # Get start page from map
                     start_page = page_map.get(start, 1)
                     current_section_page = start_page
-                    section_content += f"[第 {start_page} 页] "
+                    section_parts.append(f"[第 {start_page} 页] ")
                     
                     for p_idx in range(start, end):
                         if char_count > MAX_SECTION_CHARS:
-                            section_content += "\n[...该章节内容过长已只截取部分...]"
+                            section_parts.append("\n[...该章节内容过长已只截取部分...]")
                             break
                         
-                        para = doc.paragraphs[p_idx]
+                        para = paragraphs[p_idx]
                         txt = para.text.strip()
                         
                         # Check for page break WITHIN the section to update marker
@@ -851,12 +958,13 @@ class DocxEngine:
                         this_para_page = page_map.get(p_idx, 1)
                         if this_para_page > current_section_page:
                             current_section_page = this_para_page
-                            section_content += f"\n\n[第 {current_section_page} 页]\n"
+                            section_parts.append(f"\n\n[第 {current_section_page} 页]\n")
                         
                         if txt:
-                            section_content += txt + "\n"
+                            section_parts.append(txt + "\n")
                             char_count += len(txt)
                             
+                    section_content = "".join(section_parts)
                     relevant_parts.append(f"\n### 章节：{title} ###\n{section_content}\n")
             
             else:
@@ -912,6 +1020,10 @@ class DocxEngine:
             return f"Error extracting with images: {str(e)}"
 
     def get_preview_data(self, start: int = 0, limit: int = None) -> List[Dict[str, Any]]:
+        """Cached per document revision; see _build_preview_data."""
+        return self._cached_view(("preview", start, limit), lambda: self._build_preview_data(start, limit))
+
+    def _build_preview_data(self, start: int = 0, limit: int = None) -> List[Dict[str, Any]]:
         """
         Extracts paragraphs to send to frontend for preview.
         Returns a list of paragraphs, each containing a list of runs with formatting.
@@ -926,39 +1038,98 @@ class DocxEngine:
         preview_data = []
         
         # Paginate
-        paragraphs = target_doc.paragraphs
+        paragraphs = self._paragraph_index(target_doc)
         if limit:
             paragraphs = paragraphs[start : start + limit]
         else:
             paragraphs = paragraphs[start:]
             
         for i, para in enumerate(paragraphs):
-            # Calculate absolute index
-            abs_index = start + i
-            runs_data = []
-            for run in para.runs:
-                # Extract color as hex string if exists
-                color = None
-                if run.font.color and run.font.color.rgb:
-                    color = f"#{run.font.color.rgb}"
-                
-                runs_data.append({
-                    "text": run.text,
-                    "bold": bool(run.bold),
-                    "italic": bool(run.italic),
-                    "underline": bool(run.underline),
-                    "color": color,
-                    "fontSize": run.font.size.pt if run.font.size else None
-                })
+            preview_data.append(self._preview_paragraph(para, i))
+        return preview_data
 
-            preview_data.append({
-                "id": i,
-                "text": para.text, # Keep raw text for easy reading/debugging
-                "style": para.style.name if para.style else "Normal",
-                "runs": runs_data
+    def _preview_paragraph(self, para, idx: int) -> Dict[str, Any]:
+        runs_data = []
+        for run in para.runs:
+            # Extract color as hex string if exists
+            color = None
+            if run.font.color and run.font.color.rgb:
+                color = f"#{run.font.color.rgb}"
+            
+            runs_data.append({
+                "text": run.text,
+                "bold": bool(run.bold),
+                "italic": bool(run.italic),
+                "underline": bool(run.underline),
+                "color": color,
+                "fontSize": run.font.size.pt if run.font.size else None
             })
-        return preview_data
+
+        return {
+            "id": idx,
+            "text": para.text, # Keep raw text for easy reading/debugging
+            "style": para.style.name if para.style else "Normal",
+            "runs": runs_data
+        }
+
+    def get_preview_bundle(self, start: int = 0, limit: int = None, with_preview: bool = True, with_html: bool = True) -> Dict[str, Any]:
+        """Cached per document revision; see _build_preview_bundle."""
+        return self._cached_view(("bundle", start, limit, with_preview, with_html), lambda: self._build_preview_bundle(start, limit, with_preview, with_html))
+
+    def _build_preview_bundle(self, start: int = 0, limit: int = None, with_preview: bool = True, with_html: bool = True) -> Dict[str, Any]:
+        """
+        Builds the get_preview_data and get_html_preview output in one walk over the body.
+        Returns {"preview": [...], "html": "...", "total": paragraph_count}.
+        Pass with_preview=False when only the HTML and the count are needed, and
+        with_html=False to skip HTML rendering ("html" is then empty).
+        """
+        target_doc = self.staging_doc if self.staging_doc else self.doc
+        if not target_doc:
+            return {"preview": [], "html": "<div class='empty-doc'>No document loaded</div>", "total": 0}
+
+        # p_lst counts body paragraphs without wrapping each one in a Paragraph proxy
+        total_paras = len(target_doc.element.body.p_lst)
+        end = start + limit if limit else None
+
+        preview_data = []
+        html_parts = ['<div class="docx-viewer">']
+        block_index = 0
+        para_index = 0
+
+        for block in self.iter_block_items(target_doc):
+            # Blocks (paragraphs + tables) run ahead of paragraphs, so once the
+            # paragraph window is passed both windows are done.
+            if end is not None and para_index >= end:
+                break
+
+            in_html = with_html and block_index >= start and (end is None or block_index < end)
+            if isinstance(block, Paragraph):
+                if with_preview and para_index >= start:
+                    preview_data.append(self._preview_paragraph(block, para_index - start))
+                if in_html:
+                    html_parts.append(self._render_paragraph_html(block, block_index))
+                para_index += 1
+            elif isinstance(block, Table):
+                if in_html:
+                    html_parts.append(self._render_table_html(block, block_index))
+            block_index += 1
+
+        if not with_html:
+            return {"preview": preview_data, "html": "", "total": total_paras}
+
+        slice_end = min(total_paras, end) if end is not None else total_paras
+        if slice_end < total_paras:
+             html_parts.append(f"<div class='page-break'>... ({total_paras - slice_end} more paragraphs) ...</div>")
+
+        html_parts.append('</div>')
+        html_parts.append('</div>')
+        return {"preview": preview_data, "html": "".join(html_parts), "total": total_paras}
+
     def get_html_preview(self, start: int = 0, limit: int = None) -> str:
+        """Cached per document revision; see _build_html_preview."""
+        return self._cached_view(("html", start, limit), lambda: self._build_html_preview(start, limit))
+
+    def _build_html_preview(self, start: int = 0, limit: int = None) -> str:
         """
         Generates an HTML representation of the document with injected IDs.
         Supports pagination via start and limit.
@@ -1018,12 +1189,12 @@ class DocxEngine:
     def get_document_structure(self) -> list:
         """
         Scans the document for Headings and returns a TOC structure.
-        Uses Outline levels for robustness.
+        Uses Outline levels for robustness. Cached per document revision.
         """
         target_doc = self.staging_doc if self.staging_doc else self.doc
         if not target_doc:
             return []
-        return self._extract_toc_from_doc(target_doc)
+        return self._cached_view(("structure",), lambda: self._extract_toc_from_doc(target_doc))
 
     def _extract_toc_from_doc(self, doc) -> list:
         toc = []
@@ -1031,16 +1202,18 @@ class DocxEngine:
         # Don't use naive (i // 100).
         current_page = 1
         char_count_since_last_page = 0
+        paragraphs = self._paragraph_index(doc)
+        texts = self._paragraph_texts(doc)
         
-        for i, para in enumerate(doc.paragraphs):
+        for i, para in enumerate(paragraphs):
             # Update Page Count (Sync with _extract_range_with_pages)
-            new_page = self._update_page_num(para, current_page, char_count_since_last_page)
+            new_page = self._update_page_num(para, current_page, char_count_since_last_page, text=texts[i])
             if new_page > current_page:
                 current_page = new_page
                 char_count_since_last_page = 0
             
             # Update char count heuristic
-            p_text = para.text.strip()
+            p_text = texts[i].strip()
             if p_text:
                 char_count_since_last_page += len(p_text)
                 if char_count_since_last_page > 800: # Consistent with main loop
@@ -1138,9 +1311,8 @@ class DocxEngine:
                 search_limit = 5 # Look at next 5 paragraphs max
                 found_snippet = False
                 
-                for peek_i in range(start_peek_id, min(start_peek_id + search_limit, len(doc.paragraphs))):
-                    peek_p = doc.paragraphs[peek_i]
-                    peek_text = peek_p.text.strip()
+                for peek_raw in texts[start_peek_id:start_peek_id + search_limit]:
+                    peek_text = peek_raw.strip()
                     if not peek_text:
                         continue
                         
@@ -1162,7 +1334,7 @@ class DocxEngine:
                 })
         
         # Calculate End Indices
-        total_paras = len(doc.paragraphs)
+        total_paras = len(paragraphs)
         for idx, item in enumerate(toc):
             if idx < len(toc) - 1:
                 item["end_id"] = toc[idx + 1]["id"] - 1
@@ -1172,6 +1344,10 @@ class DocxEngine:
         return toc
 
     def get_global_context(self) -> str:
+        """Cached per document revision; see _build_global_context."""
+        return self._cached_view(("global_context",), self._build_global_context)
+
+    def _build_global_context(self) -> str:
         """
         Generates a compressed summary of the document (Heading + First Paragraph).
         Used to provide global context to the LLM.
@@ -1182,6 +1358,7 @@ class DocxEngine:
             
         summary_lines = ["【全书大纲与摘要】:"]
         target_doc = self.staging_doc if self.staging_doc else self.doc
+        paragraphs = self._paragraph_index(target_doc)
         
         for item in toc:
             # Add Title
@@ -1191,8 +1368,8 @@ class DocxEngine:
             # Add snippet of content (next paragraph if it exists and isn't a heading)
             # This is a heuristic: "Read the first bit of this section"
             start_id = item['id']
-            if start_id + 1 < len(target_doc.paragraphs):
-                next_para = target_doc.paragraphs[start_id + 1]
+            if start_id + 1 < len(paragraphs):
+                next_para = paragraphs[start_id + 1]
                 # Avoid if next para is also a heading
                 if next_para.text.strip() and (not next_para.style or "heading" not in next_para.style.name.lower()):
                     # Truncate to ~100 chars
@@ -1266,7 +1443,7 @@ class DocxEngine:
     def get_paragraph_count(self):
         target_doc = self.staging_doc if self.staging_doc else self.doc
         if target_doc:
-            return len(target_doc.paragraphs)
+            return self._cached_view(("count",), lambda: len(target_doc.element.body.p_lst))
         return 0
 
 
@@ -1370,6 +1547,7 @@ class DocxEngine:
         self.doc.save(stream)
         stream.seek(0)
         self.staging_doc = Document(stream)
+        self.touch()
 
     def commit_staging(self):
         """
@@ -1378,6 +1556,7 @@ class DocxEngine:
         if self.staging_doc:
             self.doc = self.staging_doc
             self.staging_doc = None
+            self.touch()
             return True
         return False
 
@@ -1386,6 +1565,7 @@ class DocxEngine:
         Discards the staging document.
         """
         self.staging_doc = None
+        self.touch()
         return True
 
     def apply_patch(self, patch_json: List[Dict[str, Any]], use_staging: bool = False) -> bool:
@@ -1405,16 +1585,19 @@ class DocxEngine:
                 self._search_replace(target_doc, op.get("target_id"), op.get("find_text"), op.get("replace_text"))
             # Future: Add insert_paragraph, delete_paragraph, etc.
         
+        self.touch()
         return True
 
-    def execute_code(self, code: str) -> bool:
+    def execute_code(self, code: str) -> tuple:
         """
         Executes the provided Python code on the document.
         The code has access to 'doc' (the Document object) and 'docx' (the module).
+        Returns (success, error_msg, error_type); error_type is the exception class
+        name ("" on success, "NoDocument" when nothing is loaded).
         """
         target_doc = self.staging_doc if self.staging_doc else self.doc
         if not target_doc:
-            return False, "No document loaded"
+            return False, "No document loaded", "NoDocument"
 
         # Define the execution context
         # Common imports for docx manipulation
@@ -1563,11 +1746,14 @@ class DocxEngine:
 
         try:
             exec(code, local_scope)
-            return True, ""
+            return True, "", ""
         except Exception as e:
             error_msg = f"Error executing code: {str(e)}"
             logging.error(error_msg)
-            return False, error_msg
+            return False, error_msg, type(e).__name__
+        finally:
+            # Even a failed script may have modified the document part-way
+            self.touch()
 
     def flexible_replace(self, doc, find_text: str, replace_text: str) -> bool:
         """
@@ -1853,3 +2039,11 @@ class DocxEngine:
         target_doc.save(stream)
         stream.seek(0)
         return stream
+
+    def save_copy(self, path: str):
+        """Saves the current document to path without touching the cache hash or modification tracking."""
+        target_doc = self.staging_doc if self.staging_doc else self.doc
+        if not target_doc:
+            return False
+        target_doc.save(path)
+        return True
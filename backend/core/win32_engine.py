@@ -1,8 +1,12 @@
 
 import sys
 import os
+import atexit
 import logging
+import queue
+import threading
 import traceback
+from concurrent.futures import Future
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -30,6 +34,16 @@ class WordAppEngine:
             logging.debug(traceback.format_exc())
             return False
 
+    def is_alive(self):
+        """True if the connected Word instance still responds (it may have been closed or crashed)."""
+        if not self.word:
+            return False
+        try:
+            self.word.Version
+            return True
+        except Exception:
+            return False
+
     def get_accurate_page_count(self, doc_path):
         """Opens doc and gets precise page count."""
         if not self.word:
@@ -133,6 +147,71 @@ class WordAppEngine:
         except Exception as e:
             logging.error(f"Error closing Word: {e}")
 
+class _WordWorker:
+    """
+    Word automation is apartment-threaded and takes seconds to launch. This
+    worker owns one COM-initialized thread with a warm WordAppEngine and runs
+    every job on it, reconnecting if Word has gone away.
+    """
+    def __init__(self):
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="word-automation", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            import pythoncom
+            pythoncom.CoInitialize()
+        except ImportError:
+            pythoncom = None
+
+        engine = None
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            fn, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if engine is None or not engine.is_alive():
+                    engine = WordAppEngine()
+                    if not engine.connect():
+                        engine = None
+                        raise RuntimeError("Failed to connect to Word")
+                future.set_result(fn(engine))
+            except BaseException as e:
+                future.set_exception(e)
+
+        if engine:
+            engine.quit()
+        if pythoncom:
+            pythoncom.CoUninitialize()
+
+    def submit(self, fn) -> Future:
+        future = Future()
+        self._jobs.put((fn, future))
+        return future
+
+    def stop(self, timeout=30):
+        self._jobs.put(None)
+        self._thread.join(timeout)
+
+_word_worker = None
+_word_worker_lock = threading.Lock()
+
+def run_with_word(fn):
+    """
+    Runs fn(engine) on the shared Word thread and returns its result.
+    Raises RuntimeError if Word cannot be started.
+    """
+    global _word_worker
+    with _word_worker_lock:
+        if _word_worker is None:
+            _word_worker = _WordWorker()
+            atexit.register(_word_worker.stop)
+    return _word_worker.submit(fn).result()
+
 def check_env():
     """Run a self-check"""
     print("--- Checking Win32 Environment ---")
@@ -7,13 +7,22 @@ DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
 TYPOS_FILE = os.path.join(DATA_DIR, '易错词纠正.txt')
 FORBIDDEN_FILE = os.path.join(DATA_DIR, '禁词检查.txt')
 ABBREVIATIONS_FILE = os.path.join(DATA_DIR, '术语简称.txt')
+# User requested filename: 常见错误修改.txt
+CUSTOM_FILE = os.path.join(DATA_DIR, '常见错误修改.txt')
+RULE_FILES = (TYPOS_FILE, FORBIDDEN_FILE, ABBREVIATIONS_FILE, CUSTOM_FILE)
 
 class RuleEngine:
     def __init__(self):
         self.typos_map = self._load_typos()
         self.custom_map = self._load_custom_corrections()
         self.forbidden_words = self._load_forbidden()
+        # Longest first, so run_checks can drop shorter words covered by a longer hit
+        self._forbidden_by_length = sorted(self.forbidden_words, key=len, reverse=True)
         self.abbreviations_text = self._load_abbreviations_raw()
+        # Prompt-context strings are fixed for the engine's lifetime; build them once
+        # instead of on every agent prompt.
+        self._typos_text = self._build_typos_text()
+        self._forbidden_text = ", ".join(self.forbidden_words)
 
     def _load_typos(self) -> Dict[str, str]:
         typos = {}
@@ -27,11 +36,9 @@ class RuleEngine:
 
     def _load_custom_corrections(self) -> Dict[str, str]:
         custom = {}
-        # User requested filename: 常见错误修改.txt
-        custom_file = os.path.join(DATA_DIR, '常见错误修改.txt')
-        if os.path.exists(custom_file):
+        if os.path.exists(CUSTOM_FILE):
             try:
-                with open(custom_file, 'r', encoding='utf-8') as f:
+                with open(CUSTOM_FILE, 'r', encoding='utf-8') as f:
                     for line in f:
                         line = line.strip()
                         if not line or line.startswith('#'): continue
@@ -95,8 +102,22 @@ class RuleEngine:
                 })
 
         # 3. Check Forbidden Words (禁词检查.txt)
-        for word in self.forbidden_words:
-            if word in text:
+        # Longest words first: a word whose every occurrence sits inside a longer
+        # match (e.g. "习" inside "习近平") is not reported again. covered marks
+        # the characters already claimed by a reported hit.
+        covered = bytearray(len(text))
+        for word in self._forbidden_by_length:
+            start = text.find(word)
+            if start == -1:
+                continue
+            has_uncovered_hit = False
+            while start != -1:
+                end = start + len(word)
+                if covered.find(0, start, end) != -1:
+                    has_uncovered_hit = True
+                    covered[start:end] = b'\x01' * (end - start)
+                start = text.find(word, start + 1)
+            if has_uncovered_hit:
                 issues.append({
                     "id": str(uuid.uuid4())[:8],
                     "type": "terminology",  # Tag as sensitive/terminology
@@ -116,18 +137,19 @@ class RuleEngine:
         
         return issues
 
-    def get_typos_text(self) -> str:
-        """Returns a string representation of typos for LLM prompt context."""
+    def _build_typos_text(self) -> str:
         combined = {**self.typos_map, **self.custom_map}
         if not combined:
             return ""
         return ", ".join([f"{k}->{v}" for k, v in combined.items()])
 
+    def get_typos_text(self) -> str:
+        """Returns a string representation of typos for LLM prompt context."""
+        return self._typos_text
+
     def get_forbidden_text(self) -> str:
         """Returns a string representation of forbidden words for LLM prompt context."""
-        if not self.forbidden_words:
-            return ""
-        return ", ".join(self.forbidden_words)
+        return self._forbidden_text
 
     def get_abbreviations_text(self) -> str:
         """Returns a string representation of abbreviations for LLM prompt context."""
@@ -2,10 +2,22 @@ import logging
 import re
 import base64
 import os
-import json
+import queue
+import orjson
 import asyncio
+import concurrent.futures
+import hashlib
+import itertools
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple, Callable, Optional
+
+try:
+    import pybase64 as _b64  # SIMD base64, drop-in for the stdlib module
+except ImportError:
+    _b64 = base64
 
 # Core Services
 from core.services import current_engine, llm_engine
@@ -14,10 +26,103 @@ from core.llm_config import get_llm_config_manager
 # Feature Modules
 from features.agent_anything import perform_anything_audit # Dual Engine Support
 from features.audit.agents import get_agent_prompt
-from features.audit.rule_engine import RuleEngine
+from features.audit.rule_engine import RuleEngine, RULE_FILES
 
 logger = logging.getLogger(__name__)
 
+# Markdown image reference: ![alt](path)
+_IMG_RE = re.compile(r'!\[[^\]]*\]\(([^)]*)\)')
+
+_FENCED_JSON_RE = re.compile(r'```(?:json)?\s*(\{.*?\})\s*```', re.DOTALL)
+_JSON_BLOCK_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+_ISSUES_ARRAY_RE = re.compile(r'"issues"\s*:\s*\[')
+
+# Multiple of 3, so chunked base64 output concatenates without inner padding
+_B64_CHUNK_SIZE = 3 * 64 * 1024
+
+_MIME_BY_EXT = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".gif": "image/gif",
+}
+
+# Shared RuleEngine, rebuilt only when one of the dictionary files changes on disk
+_RULE_ENGINE = None
+_RULE_ENGINE_MTIMES = None
+
+def _get_rule_engine() -> RuleEngine:
+    global _RULE_ENGINE, _RULE_ENGINE_MTIMES
+    mtimes = tuple(os.path.getmtime(p) if os.path.exists(p) else None for p in RULE_FILES)
+    if _RULE_ENGINE is None or mtimes != _RULE_ENGINE_MTIMES:
+        _RULE_ENGINE = RuleEngine()
+        _RULE_ENGINE_MTIMES = mtimes
+    return _RULE_ENGINE
+
+# Process-wide cap on concurrent LLM calls per provider, shared by all audit requests.
+# Threading semaphores are used because every request runs its own event loop
+# (asyncio.run in routes.py) and the provider calls execute in worker threads.
+_PROVIDER_LIMITS = {"gemini": 1}
+_DEFAULT_PROVIDER_LIMIT = 5
+_PROVIDER_SEMAPHORES: Dict[str, threading.BoundedSemaphore] = {}
+_PROVIDER_SEMAPHORES_LOCK = threading.Lock()
+
+def _get_provider_semaphore(provider: str) -> threading.BoundedSemaphore:
+    with _PROVIDER_SEMAPHORES_LOCK:
+        sem = _PROVIDER_SEMAPHORES.get(provider)
+        if sem is None:
+            sem = threading.BoundedSemaphore(_PROVIDER_LIMITS.get(provider, _DEFAULT_PROVIDER_LIMIT))
+            _PROVIDER_SEMAPHORES[provider] = sem
+        return sem
+
+# In-flight realtime checks keyed by (content, source, model_config)
+_REALTIME_INFLIGHT: Dict[Tuple[str, str, bytes], concurrent.futures.Future] = {}
+_REALTIME_INFLIGHT_LOCK = threading.Lock()
+
+# Short-lived cache of raw LLM replies keyed by (provider, model, prompt, images).
+# Realtime checks and repeated audits often resend the exact same prompt.
+_LLM_CACHE_TTL = 300
+_LLM_CACHE_MAXSIZE = 512
+_LLM_CACHE: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+_LLM_CACHE_LOCK = threading.Lock()
+
+def _is_llm_error(result: str) -> bool:
+    """Provider failures come back as text: "# Error..." or a reply mentioning HTTP 403."""
+    return not isinstance(result, str) or result.strip().startswith("# Error") or "403" in result
+
+def _llm_cache_key(provider: str, api_key: str, model: str, prompt: str, images: List[str]) -> str:
+    # api_key is part of the key so a corrected key never reuses another key's replies
+    h = hashlib.blake2b(f"{provider}|{api_key}|{model}|".encode("utf-8"), digest_size=16)
+    h.update(prompt.encode("utf-8"))
+    for img in images or []:
+        h.update(img.encode("ascii", "ignore"))
+    return h.hexdigest()
+
+def _cached_llm_call(provider: str, api_key: str, model: str, prompt: str, images: List[str], call: Callable[[], str]) -> str:
+    """Runs call() unless an identical request succeeded within the TTL."""
+    key = _llm_cache_key(provider, api_key, model, prompt, images)
+    now = time.monotonic()
+    with _LLM_CACHE_LOCK:
+        entry = _LLM_CACHE.get(key)
+        if entry is not None:
+            if now - entry[0] <= _LLM_CACHE_TTL:
+                _LLM_CACHE.move_to_end(key)
+                return entry[1]
+            del _LLM_CACHE[key]
+
+    result = call()
+
+    # Never cache failures, so the next request retries the provider
+    if not _is_llm_error(result):
+        with _LLM_CACHE_LOCK:
+            _LLM_CACHE[key] = (now, result)
+            _LLM_CACHE.move_to_end(key)
+            while len(_LLM_CACHE) > _LLM_CACHE_MAXSIZE:
+                _LLM_CACHE.popitem(last=False)
+    return result
+
 async def perform_audit(data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Orchestrates the audit process. 
@@ -60,10 +165,10 @@ async def perform_audit(data: Dict[str, Any]) -> Dict[str, Any]:
         source_text = "(No source documents provided)"
 
     # 4. Collect Images
-    images = _collect_images(source_text)
+    images = await _collect_images_async(source_text)
 
     # 5. Offline Rule Check (Fast)
-    rule_engine = RuleEngine()
+    rule_engine = _get_rule_engine()
     rule_issues = rule_engine.run_checks(target_text)
 
     # 6. LLM Execution
@@ -88,52 +193,48 @@ async def perform_audit(data: Dict[str, Any]) -> Dict[str, Any]:
     # 7. Multi-Agent Execution (Async Parallel)
     logger.info(f"Executing Specialized Agents (Async): {requested_agents}")
     
-    semaphore = asyncio.Semaphore(1 if provider == "gemini" else 5)
-
     async def _run_single_agent(agent_type):
-        async with semaphore:
-            try:
-                # Prepare optional context
-                kwargs = {}
-                if agent_type == "proofread":
-                    kwargs["user_typos"] = rule_engine.get_typos_text()
-                elif agent_type == "terminology":
-                    kwargs["user_forbidden"] = rule_engine.get_forbidden_text()
-                    kwargs["user_abbreviations"] = rule_engine.get_abbreviations_text()
-
-                prompt = get_agent_prompt(agent_type, target_text, source_text, **kwargs)
-                
-                def _call():
+        try:
+            # Prepare optional context
+            kwargs = {}
+            if agent_type == "proofread":
+                kwargs["user_typos"] = rule_engine.get_typos_text()
+            elif agent_type == "terminology":
+                kwargs["user_forbidden"] = rule_engine.get_forbidden_text()
+                kwargs["user_abbreviations"] = rule_engine.get_abbreviations_text()
+
+            prompt = get_agent_prompt(agent_type, target_text, source_text, **kwargs)
+            
+            def _call():
+                with _get_provider_semaphore(provider):
                     if provider == "gemini":
                         return llm_engine._call_google_gemini(api_key, prompt, endpoint, model, images)
                     else:
                         # Default to OpenAI-compatible for all other providers (openai, deepseek, ali, doubao, free, etc.)
                         return llm_engine._call_openai_compatible(api_key, endpoint, model, prompt)
-                
-                agent_result_str = await asyncio.to_thread(_call)
-                
-                # Error Check
-                if agent_result_str.strip().startswith("# Error") or "403" in agent_result_str:
-                    logger.error(f"Agent {agent_type} error: {agent_result_str}")
-                    return []
-
-                parsed = _parse_llm_result(agent_result_str)
-                if isinstance(parsed, dict) and "issues" in parsed:
-                    for issue in parsed["issues"]:
-                        issue["agent"] = agent_type
-                    return parsed["issues"]
-                return []
-            except Exception as e:
-                logger.error(f"Agent {agent_type} exception: {e}")
+            
+            agent_result_str = await asyncio.to_thread(_cached_llm_call, provider, api_key, model, prompt, images, _call)
+            
+            # Error Check
+            if _is_llm_error(agent_result_str):
+                logger.error(f"Agent {agent_type} error: {agent_result_str}")
                 return []
 
+            parsed = _parse_llm_result(agent_result_str)
+            if isinstance(parsed, dict) and "issues" in parsed:
+                for issue in parsed["issues"]:
+                    issue["agent"] = agent_type
+                return parsed["issues"]
+            return []
+        except Exception as e:
+            logger.error(f"Agent {agent_type} exception: {e}")
+            return []
+
     tasks = [_run_single_agent(agent) for agent in requested_agents]
     results_list = await asyncio.gather(*tasks)
     
     # Aggregate
-    aggregated_issues = list(rule_issues)
-    for res in results_list:
-        aggregated_issues.extend(res)
+    aggregated_issues = list(itertools.chain(rule_issues, *results_list))
 
     return {
         "status": "WARNING" if aggregated_issues else "PASS",
@@ -145,7 +246,31 @@ async def perform_audit(data: Dict[str, Any]) -> Dict[str, Any]:
 def perform_audit_stream(data: Dict[str, Any]):
     """
     NDJSON Stream Audit
+    The LLM stream is drained by a worker thread that feeds a queue, so a slow
+    client never stalls the read from the provider.
     """
+    lines: "queue.Queue[Optional[bytes]]" = queue.Queue()
+    stop = threading.Event()
+
+    def _produce():
+        try:
+            for line in _audit_stream_lines(data, stop):
+                lines.put(line)
+        finally:
+            lines.put(None)
+
+    threading.Thread(target=_produce, daemon=True).start()
+    try:
+        while True:
+            line = lines.get()
+            if line is None:
+                break
+            yield line
+    finally:
+        # Client went away or stream finished: let the producer stop early
+        stop.set()
+
+def _audit_stream_lines(data: Dict[str, Any], stop: threading.Event):
     # 1. Extract & Config
     source_text = data.get("source", "")
     target_text = data.get("content", "")
@@ -158,40 +283,83 @@ def perform_audit_stream(data: Dict[str, Any]):
     # 2. Images
     images = _collect_images(source_text)
 
-    # 3. Execution (Legacy Monolithic Style for Stream currently)
+    # 3. Execution (Streamed: each issue is emitted as soon as its JSON object is complete)
     try:
-        full_result = llm_engine.audit_document(
+        parser = _IssueStreamParser()
+        issue_count = 0
+        for chunk in llm_engine.stream_audit_document(
             source_text=source_text,
             target_text=target_text,
             rules=rules,
             images=images,
             model_config=resolved_config
-        )
-        
+        ):
+            if stop.is_set():
+                return
+            for issue in parser.feed(chunk):
+                issue_count += 1
+                yield orjson.dumps({"type": "issue", "data": issue}) + b"\n"
+
+        full_result = parser.text
+        if full_result.lstrip().startswith("# Error"):
+            yield orjson.dumps({"type": "error", "data": {"message": full_result.strip()}}) + b"\n"
+            return
+
         parsed = _parse_llm_result(full_result)
-        
-        # Yield Issues
-        issues = parsed.get("issues", [])
-        for issue in issues:
-            yield json.dumps({"type": "issue", "data": issue}, ensure_ascii=False) + "\n"
+
+        # Fallback: the incremental scan found nothing, but the full payload parses
+        if issue_count == 0:
+            for issue in parsed.get("issues", []):
+                issue_count += 1
+                yield orjson.dumps({"type": "issue", "data": issue}) + b"\n"
         
         # Yield Summary
         summary_data = {
             "status": parsed.get("status", "PASS"),
             "score": parsed.get("score", 100),
             "summary": parsed.get("summary", ""),
-            "total_issues": len(issues)
+            "total_issues": issue_count
         }
-        yield json.dumps({"type": "summary", "data": summary_data}, ensure_ascii=False) + "\n"
+        yield orjson.dumps({"type": "summary", "data": summary_data}) + b"\n"
     
     except Exception as e:
         logging.error(f"Audit stream error: {e}")
-        yield json.dumps({"type": "error", "data": {"message": str(e)}}, ensure_ascii=False) + "\n"
+        yield orjson.dumps({"type": "error", "data": {"message": str(e)}}) + b"\n"
 
 async def perform_realtime_check(data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Lightweight Realtime Check for Editor
+    Identical checks that arrive while one is still running share its result
+    instead of issuing another LLM call.
     """
+    key = (
+        data.get("content", ""),
+        data.get("source", ""),
+        orjson.dumps(data.get("model_config") or {}, option=orjson.OPT_SORT_KEYS),
+    )
+    with _REALTIME_INFLIGHT_LOCK:
+        future = _REALTIME_INFLIGHT.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = concurrent.futures.Future()
+            _REALTIME_INFLIGHT[key] = future
+
+    if not is_owner:
+        # concurrent.futures (not asyncio) futures: each request runs in its own event loop
+        return await asyncio.wrap_future(future)
+
+    try:
+        result = await _run_realtime_check(data)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _REALTIME_INFLIGHT_LOCK:
+            _REALTIME_INFLIGHT.pop(key, None)
+
+async def _run_realtime_check(data: Dict[str, Any]) -> Dict[str, Any]:
     # 1. Extract
     target_text = data.get("content", "")
     source_text = data.get("source", "")
@@ -201,7 +369,7 @@ async def perform_realtime_check(data: Dict[str, Any]) -> Dict[str, Any]:
         return {"issues": []}
 
     # 2. Offline Rules
-    rule_engine = RuleEngine()
+    rule_engine = _get_rule_engine()
     rule_issues = rule_engine.run_checks(target_text)
     
     # 3. LLM (Proofread Only)
@@ -217,6 +385,7 @@ async def perform_realtime_check(data: Dict[str, Any]) -> Dict[str, Any]:
     user_typos = rule_engine.get_typos_text()
     prompt = get_agent_prompt("proofread", target_text, source_text, user_typos=user_typos)
     
+    # Not gated by the provider semaphores: keystroke checks must not queue behind full audits
     def _call_sync():
         if provider == "gemini":
             return llm_engine._call_google_gemini(api_key, prompt, endpoint, model, [])
@@ -226,12 +395,12 @@ async def perform_realtime_check(data: Dict[str, Any]) -> Dict[str, Any]:
 
 
     try:
-        raw_result = await asyncio.to_thread(_call_sync)
+        raw_result = await asyncio.to_thread(_cached_llm_call, provider, api_key, model, prompt, [], _call_sync)
         parsed = _parse_llm_result(raw_result)
         ai_issues = parsed.get("issues", []) if isinstance(parsed, dict) else []
         
         # 合并所有问题
-        all_issues = rule_issues + ai_issues
+        all_issues = list(itertools.chain(rule_issues, ai_issues))
         total_issues = len(all_issues)
         
         # 添加正向反馈
@@ -258,36 +427,163 @@ async def perform_realtime_check(data: Dict[str, Any]) -> Dict[str, Any]:
 
 # --- Helpers ---
 
-def _collect_images(source_text: str) -> List[str]:
-    images = []
+def _collect_image_paths(source_text: str) -> List[str]:
+    """Resolves /static/images/ references in the source markdown to existing files."""
+    paths = []
     try:
         base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-        img_matches = re.findall(r'!\[.*?\]\((.*?)\)', source_text)
-        for img_path in img_matches:
+        images_dir = os.path.join(base_dir, "static", "images")
+        available = None  # names in images_dir, listed once on the first reference
+        for m in _IMG_RE.finditer(source_text):
+            img_path = m.group(1)
             if "/static/images/" in img_path:
-                try:
-                     rel_path = img_path.lstrip("/") 
-                     abs_path = os.path.join(base_dir, *rel_path.split("/"))
-                     if os.path.exists(abs_path):
-                         with open(abs_path, "rb") as img_f:
-                             b64_data = base64.b64encode(img_f.read()).decode('utf-8')
-                             mime = "image/png"
-                             if abs_path.lower().endswith((".jpg", ".jpeg")): mime = "image/jpeg"
-                             elif abs_path.lower().endswith(".webp"): mime = "image/webp"
-                             images.append(f"data:{mime};base64,{b64_data}")
-                except: pass
+                rel_path = img_path.lstrip("/")
+                abs_path = os.path.join(base_dir, *rel_path.split("/"))
+                if os.path.dirname(abs_path) == images_dir:
+                    if available is None:
+                        try:
+                            available = {e.name for e in os.scandir(images_dir)}
+                        except OSError:
+                            available = set()
+                    exists = os.path.basename(abs_path) in available
+                else:
+                    exists = os.path.exists(abs_path)
+                if exists:
+                    paths.append(abs_path)
     except: pass
+    return paths
+
+# Encoded data URIs are cached within a byte budget (not an entry count), so a
+# batch of large scans cannot stay resident; files above the per-file cap are never cached
+_IMAGE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+_IMAGE_CACHE_MAX_FILE = 2 * 1024 * 1024
+_IMAGE_CACHE: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+_IMAGE_CACHE_BYTES = 0
+_IMAGE_CACHE_LOCK = threading.Lock()
+
+def _encode_image(abs_path: str) -> str:
+    """Reads an image file and returns it as a base64 data URI."""
+    global _IMAGE_CACHE_BYTES
+    st = os.stat(abs_path)
+    if st.st_size > _IMAGE_CACHE_MAX_FILE:
+        return _read_image_data_uri(abs_path)
+
+    # mtime_ns/size are part of the cache key so an edited file is re-encoded
+    key = (abs_path, st.st_mtime_ns, st.st_size)
+    with _IMAGE_CACHE_LOCK:
+        uri = _IMAGE_CACHE.get(key)
+        if uri is not None:
+            _IMAGE_CACHE.move_to_end(key)
+            return uri
+
+    uri = _read_image_data_uri(abs_path)
+    with _IMAGE_CACHE_LOCK:
+        if key not in _IMAGE_CACHE:
+            _IMAGE_CACHE[key] = uri
+            _IMAGE_CACHE_BYTES += len(uri)
+            while _IMAGE_CACHE_BYTES > _IMAGE_CACHE_MAX_BYTES:
+                _, evicted = _IMAGE_CACHE.popitem(last=False)
+                _IMAGE_CACHE_BYTES -= len(evicted)
+    return uri
+
+def _read_image_data_uri(abs_path: str) -> str:
+    mime = _MIME_BY_EXT.get(os.path.splitext(abs_path)[1].lower(), "image/png")
+    buf = bytearray(f"data:{mime};base64,".encode("ascii"))
+    with open(abs_path, "rb") as img_f:
+        # Encode chunk by chunk so the raw file is never held in memory whole
+        while chunk := img_f.read(_B64_CHUNK_SIZE):
+            buf += _b64.b64encode(chunk)
+    return buf.decode("ascii")
+
+def _collect_images(source_text: str) -> List[str]:
+    images = []
+    for abs_path in _collect_image_paths(source_text):
+        try:
+            images.append(_encode_image(abs_path))
+        except: pass
     return images
 
+async def _collect_images_async(source_text: str) -> List[str]:
+    """
+    Async variant of _collect_images: reads and encodes every image concurrently
+    in worker threads so the event loop is not blocked by disk I/O or base64 work.
+    """
+    paths = _collect_image_paths(source_text)
+    results = await asyncio.gather(
+        *[asyncio.to_thread(_encode_image, p) for p in paths],
+        return_exceptions=True
+    )
+    return [r for r in results if isinstance(r, str)]
+
+class _IssueStreamParser:
+    """
+    Incrementally extracts the objects of the "issues" array from LLM output
+    that arrives in chunks. feed() returns the issues completed by each chunk.
+    """
+    def __init__(self):
+        self.text = ""
+        self._pos = -1  # scan offset inside the issues array, -1 until it is found
+        self._depth = 0
+        self._in_str = False
+        self._escape = False
+        self._obj_start = -1
+        self._done = False
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self.text += chunk
+        items = []
+        if self._done:
+            return items
+        if self._pos < 0:
+            m = _ISSUES_ARRAY_RE.search(self.text)
+            if not m:
+                return items
+            self._pos = m.end()
+
+        text = self.text
+        i = self._pos
+        while i < len(text):
+            c = text[i]
+            if self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_str = False
+            elif c == '"':
+                self._in_str = True
+            elif c == "{":
+                if self._depth == 0:
+                    self._obj_start = i
+                self._depth += 1
+            elif c == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        items.append(orjson.loads(text[self._obj_start:i + 1]))
+                    except orjson.JSONDecodeError:
+                        pass
+            elif c == "]" and self._depth == 0:
+                self._done = True
+                break
+            i += 1
+        self._pos = i
+        return items
+
 def _parse_llm_result(raw_result: Any) -> Dict[str, Any]:
     try:
         if isinstance(raw_result, str):
-            clean = raw_result.replace("```json", "").replace("```", "").strip()
-            first_brace = clean.find("{")
-            last_brace = clean.rfind("}")
-            if first_brace != -1 and last_brace != -1:
-                clean = clean[first_brace:last_brace+1]
-            return json.loads(clean)
+            # Prefer a fenced ```json block, so braces in surrounding commentary are ignored
+            m = _FENCED_JSON_RE.search(raw_result)
+            if m:
+                try:
+                    return orjson.loads(m.group(1))
+                except orjson.JSONDecodeError:
+                    pass
+            # Otherwise the outermost {...} block
+            m = _JSON_BLOCK_RE.search(raw_result)
+            return orjson.loads(m.group(0) if m else raw_result)
         return raw_result
     except Exception:
         return {"error": "Failed to parse result", "raw": str(raw_result)}
@@ -0,0 +1,33 @@
+"""
+Markdown line classification for /export_docx.
+
+Kept free of Flask/docx imports and fully annotated so it can be compiled in
+place with mypyc (`mypyc features/canvas/_line_classifier.py`); Python picks up
+the compiled module when it is present and falls back to this file otherwise.
+"""
+import re
+from typing import Tuple
+
+_MD_IMG_RE = re.compile(r'!\[.*?\]\((.*?)\)')
+_LEVEL_RE = re.compile(r'^(?P<l1>[一二三四五六七八九十]+、)|^(?P<l2>（[一二三四五六七八九十]+）)')
+_MD_STRIP_TABLE = str.maketrans('', '', '*#')
+
+
+def classify_line(stripped_line: str, is_first: bool) -> Tuple[str, str]:
+    """
+    Classifies one non-empty markdown line.
+    Returns ("image", url) for ![alt](url) lines, otherwise
+    ("title" | "l1" | "l2" | "body", text with '*' and '#' removed).
+    """
+    img_match = _MD_IMG_RE.search(stripped_line)
+    if img_match:
+        return "image", img_match.group(1)
+
+    clean_text = stripped_line.translate(_MD_STRIP_TABLE).strip()
+    if is_first:
+        return "title", clean_text
+
+    level_match = _LEVEL_RE.match(clean_text)
+    if level_match:
+        return str(level_match.lastgroup), clean_text
+    return "body", clean_text
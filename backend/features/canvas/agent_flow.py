@@ -1,11 +1,35 @@
 import logging
 import json
+import hashlib
+import re
 from typing import Dict, Any, List, Optional
 from core.llm_engine import LLMEngine
 from core.docx_engine import DocxEngine
 
 logger = logging.getLogger(__name__)
 
+_LINE_NO_RE = re.compile(r'line \d+')
+
+# Failures re-prompting cannot fix: the document or environment is at fault, not the code
+_NON_RETRIABLE_ERRORS = {"NoDocument", "OSError", "IOError", "FileNotFoundError", "PermissionError", "MemoryError"}
+
+# Self-correction prompt; static text stays byte-identical across retries
+_FIX_TEMPLATE = (
+    "The previous code failed with the following error:\n{error}\n\n"
+    "Please fix the Python code to strictly follow the instruction: {instruction}"
+)
+
+def _failure_keys(code: str, error_msg: str):
+    """
+    Fingerprints of a failed attempt: the exact (code, error) pair, and the
+    last error line with line numbers normalized so renumbered tracebacks collide.
+    """
+    error_msg = error_msg or ""
+    exact = hashlib.blake2b((code + '\x00' + error_msg).encode(), digest_size=16).digest()
+    lines = error_msg.strip().splitlines()
+    last_line = _LINE_NO_RE.sub('line N', lines[-1] if lines else "")
+    return exact, hashlib.blake2b(last_line.encode(), digest_size=16).digest()
+
 class CanvasAgent:
     def __init__(self, llm: LLMEngine, doc_engine: DocxEngine):
         self.llm = llm
@@ -20,6 +44,7 @@ class CanvasAgent:
         3. Catch Error -> Self-Correct (Reflect) -> Re-execute
         """
         history = []
+        seen_failures = set()
         attempt = 1
         
         reply = "I have drafted the changes based on your instruction."
@@ -42,34 +67,42 @@ class CanvasAgent:
             logger.info(f"Agentic Loop: Attempt {attempt}")
             
             # Execute
-            success, error_msg = self.doc_engine.execute_code(code)
+            success, error_msg, error_type = self.doc_engine.execute_code(code)
             
             if success:
                 logger.info("Agentic Loop: Execution Successful")
                 # TODO: Optional Visual Verification (Did it actually change?)
                 # For now, success execution is good enough for speed.
+                bundle = self.doc_engine.get_preview_bundle(limit=self.doc_engine.PREVIEW_PAGE_SIZE)
                 return {
                     "success": True,
                     "code": code,
                     "reply": reply,
-                    "preview": self.doc_engine.get_preview_data(),
-                    "html_preview": self.doc_engine.get_html_preview()
+                    "preview": bundle["preview"],
+                    "html_preview": bundle["html"]
                 }
             
             # Failure -> Reflect and Fix
             logger.warning(f"Agentic Loop: Execution Failed: {error_msg}")
+
+            if error_type in _NON_RETRIABLE_ERRORS:
+                logger.warning(f"Agentic Loop: {error_type} is not fixable by regenerating code, aborting.")
+                break
+
+            # Same code/error as an earlier attempt: another retry would be doomed too
+            failure_keys = _failure_keys(code, error_msg)
+            if seen_failures.intersection(failure_keys):
+                logger.warning("Agentic Loop: Repeated failure, aborting retries.")
+                break
+            seen_failures.update(failure_keys)
+
             attempt += 1
             
             if attempt > self.max_retries + 1:
                 break
                 
             # Self-Correction Step
-            fix_instruction = f"""
-            The previous code failed with the following error:
-            {error_msg}
-            
-            Please fix the Python code to strictly follow the instruction: {instruction}
-            """
+            fix_instruction = _FIX_TEMPLATE.format_map({'error': error_msg, 'instruction': instruction})
             
             # Re-call LLM with error context
             # We treat this as a "fix" task
@@ -3,14 +3,43 @@ Canvas Converter Routes
 提供快速画布与DOCX互转的API端点
 """
 from flask import Blueprint, request, jsonify, send_file
-from features.canvas_converter import tiptap_to_docx, docx_to_tiptap
+from features.canvas_converter import tiptap_to_docx, tiptap_to_smart_docx, docx_to_tiptap, docx_to_tiptap_from_path
+from core.docx_engine import package_etag
 import logging
-import io
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
 logger = logging.getLogger(__name__)
 
 canvas_converter_bp = Blueprint('canvas_converter', __name__, url_prefix='/api/canvas')
 
+# 转换是纯 CPU 计算，放到进程池中避免阻塞 Flask 工作线程、绕开 GIL。
+# 进程池在首次使用时才创建：Windows 下子进程以 spawn 方式重新导入模块，不能在导入时建池。
+_CONVERT_POOL = None
+_CONVERT_POOL_LOCK = threading.Lock()
+_CONVERT_TIMEOUT = 120
+# 小于该大小的导出/导入请求直接在当前进程转换，省去跨进程序列化开销
+_INLINE_CONVERT_BYTES = 50 * 1024
+
+def _get_convert_pool() -> ProcessPoolExecutor:
+    global _CONVERT_POOL
+    with _CONVERT_POOL_LOCK:
+        if _CONVERT_POOL is None:
+            _CONVERT_POOL = ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+        return _CONVERT_POOL
+
+def _is_small_request() -> bool:
+    return request.content_length is not None and request.content_length < _INLINE_CONVERT_BYTES
+
+def _run_export(convert, tiptap_json):
+    """执行 Tiptap -> DOCX 转换：小请求在本进程完成，大请求交给进程池（结果需跨进程传回，使用 BytesIO）"""
+    if _is_small_request():
+        return convert(tiptap_json)
+    return _get_convert_pool().submit(convert, tiptap_json, spooled=False).result(timeout=_CONVERT_TIMEOUT)
+
 @canvas_converter_bp.route('/export-to-docx', methods=['POST'])
 def export_to_docx():
     """
@@ -32,14 +61,16 @@ def export_to_docx():
         tiptap_json = data['content']
         
         # 转换为DOCX
-        docx_buffer = tiptap_to_docx(tiptap_json)
+        docx_buffer = _run_export(tiptap_to_docx, tiptap_json)
         
         # 返回文件
         return send_file(
             docx_buffer,
             mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
             as_attachment=True,
-            download_name='export.docx'
+            download_name='export.docx',
+            conditional=True,
+            etag=package_etag(docx_buffer)
         )
     
     except Exception as e:
@@ -51,21 +82,21 @@ def export_smart_docx():
     """
     智能公文格式导出 (Smart Gov Doc Export)
     """
-    from features.canvas_converter import tiptap_to_smart_docx
-    
     try:
         data = request.get_json()
         if not data or 'content' not in data:
             return jsonify({"error": "Missing 'content' field"}), 400
             
         tiptap_json = data['content']
-        docx_buffer = tiptap_to_smart_docx(tiptap_json)
+        docx_buffer = _run_export(tiptap_to_smart_docx, tiptap_json)
         
         return send_file(
             docx_buffer,
             mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
             as_attachment=True,
-            download_name='smart_export.docx'
+            download_name='smart_export.docx',
+            conditional=True,
+            etag=package_etag(docx_buffer)
         )
     except Exception as e:
         logger.error(f"Smart Export failed: {e}")
@@ -95,11 +126,20 @@ def import_from_docx():
         if not file.filename.lower().endswith('.docx'):
             return jsonify({"error": "Only DOCX files are supported"}), 400
         
-        # 读取文件流
-        file_stream = io.BytesIO(file.read())
+        # 转换为Tiptap JSON：小文件在本进程完成
+        if _is_small_request():
+            return jsonify(docx_to_tiptap(file.stream))
         
-        # 转换为Tiptap JSON
-        tiptap_json = docx_to_tiptap(file_stream)
+        # 大文件写入临时文件，子进程只需接收文件路径
+        tmp_path = None
+        try:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
+                tmp_path = tmp.name
+                shutil.copyfileobj(file.stream, tmp, 1024 * 1024)
+            tiptap_json = _get_convert_pool().submit(docx_to_tiptap_from_path, tmp_path).result(timeout=_CONVERT_TIMEOUT)
+        finally:
+            if tmp_path is not None:
+                os.remove(tmp_path)
         
         return jsonify(tiptap_json)
     
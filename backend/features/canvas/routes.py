@@ -1,19 +1,37 @@
 import re
-from flask import Blueprint, request, jsonify, Response, send_file, current_app
+from flask import Blueprint, request, jsonify, Response, send_file, current_app, stream_with_context
 import logging
+import functools
 import io
 import os
-from typing import List, Dict, Any
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
 from docx import Document
 from docx.shared import Pt, Cm
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.oxml.ns import qn
 from core.services import current_engine, llm_engine
-from core.win32_engine import WordAppEngine
+from core.docx_engine import package_etag
+from core.win32_engine import run_with_word
 from features.canvas.agent_flow import CanvasAgent
+from features.canvas._line_classifier import classify_line
 
 canvas_bp = Blueprint('canvas', __name__)
 
+# backend/ and the directories under it, resolved once at import
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_CACHE_DIR = os.path.join(_BASE_DIR, ".cache")
+_TEMP_DIR = os.path.join(_BASE_DIR, 'static', 'temp')
+_IMAGES_DIR = os.path.join(_BASE_DIR, 'static', 'images')
+os.makedirs(_CACHE_DIR, exist_ok=True)
+os.makedirs(_TEMP_DIR, exist_ok=True)
+
 @canvas_bp.route('/logs', methods=['GET'])
 def get_canvas_logs():
     try:
@@ -49,6 +67,63 @@ def get_canvas_logs():
     except Exception as e:
         return jsonify({"logs": f"Error reading logs: {str(e)}"}), 500
 
+def _wants_html() -> bool:
+    """
+    HTML rendering is the expensive half of a preview. Clients that keep their
+    own rendered view can opt out with ?include_html=0 or "include_html": false.
+    """
+    if request.args.get("include_html") == "0":
+        return False
+    data = request.get_json(silent=True) or {}
+    return data.get("include_html", True) is not False
+
+def _preview_fields(with_html: bool = True) -> Dict[str, Any]:
+    """First preview page as response fields: preview, plus html_preview unless with_html is False."""
+    bundle = current_engine.get_preview_bundle(limit=current_engine.PREVIEW_PAGE_SIZE, with_html=with_html)
+    fields = {"preview": bundle["preview"]}
+    if with_html:
+        fields["html_preview"] = bundle["html"]
+    return fields
+
+# Werkzeug already spools uploads to a temp file; read them straight from
+# file.stream in 1 MB chunks instead of copying into another buffer.
+_UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+def _remove_temp_file(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.warning(f"Failed to remove temp file {path}: {e}")
+
+def _send_docx_file(save, download_name: str):
+    """
+    Saves via save(path) into a temp file and sends it by path, so the WSGI
+    server's file_wrapper can use sendfile(2). The file is removed once the
+    response is closed.
+    """
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
+        tmp_path = tmp.name
+    _cleanup = functools.partial(_remove_temp_file, tmp_path)
+
+    try:
+        if save(tmp_path) is False:
+            raise ValueError("No document loaded")
+        response = send_file(
+            tmp_path,
+            mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+            as_attachment=True,
+            download_name=download_name,
+            conditional=True,
+            etag=package_etag(tmp_path)
+        )
+    except Exception:
+        _cleanup()
+        raise
+    response.call_on_close(_cleanup)
+    return response
+
 @canvas_bp.route('/upload', methods=['POST'])
 def canvas_upload():
     try:
@@ -62,35 +137,32 @@ def canvas_upload():
             return jsonify({"error": "No selected file"}), 400
         
         logging.info(f"Canvas Upload: processing file {file.filename}")
-        content = file.read()
-        logging.info(f"Canvas Upload: file size {len(content)} bytes")
+        content = file.stream
+        content.seek(0, os.SEEK_END)
+        logging.info(f"Canvas Upload: file size {content.tell()} bytes")
         
         # PERSISTENCE: Save to cache
         try:
-            base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-            cache_dir = os.path.join(base_dir, ".cache")
-            if not os.path.exists(cache_dir): os.makedirs(cache_dir, exist_ok=True)
-            
-            cache_path = os.path.join(cache_dir, "last_canvas.docx")
+            cache_path = os.path.join(_CACHE_DIR, "last_canvas.docx")
+            content.seek(0)
             with open(cache_path, "wb") as f:
-                f.write(content)
+                shutil.copyfileobj(content, f, _UPLOAD_CHUNK_SIZE)
             logging.info(f"Canvas Upload: Persisted to {cache_path}")
         except Exception as e:
             logging.warning(f"Failed to persist canvas: {e}")
         
-        current_engine.load_document(io.BytesIO(content))
+        content.seek(0)
+        current_engine.load_document(content)
         current_engine.original_path = cache_path # Ensure persistence path is set
         logging.info("Canvas Upload: load_document successful")
         
         # Pagination defaults
         page_size = 100
-        total_paras = current_engine.get_paragraph_count()
-        
-        preview = current_engine.get_preview_data(start=0, limit=page_size)
-        logging.info(f"Canvas Upload: preview items count: {len(preview)}")
+        bundle = current_engine.get_preview_bundle(start=0, limit=page_size)
+        logging.info(f"Canvas Upload: preview items count: {len(bundle['preview'])}")
         
-        html_preview = current_engine.get_html_preview(limit=page_size)
-        total_paragraphs = current_engine.get_paragraph_count()
+        html_preview = bundle["html"]
+        total_paragraphs = bundle["total"]
         structure = current_engine.get_document_structure()
         
         return jsonify({
@@ -117,10 +189,10 @@ def create_with_text():
         
         # Pagination defaults
         page_size = 100
-        total_paras = current_engine.get_paragraph_count()
+        bundle = current_engine.get_preview_bundle(limit=page_size, with_preview=False)
         
-        html_preview = current_engine.get_html_preview(limit=page_size)
-        total_paragraphs = current_engine.get_paragraph_count()
+        html_preview = bundle["html"]
+        total_paragraphs = bundle["total"]
         structure = current_engine.get_document_structure()
         
         return jsonify({
@@ -150,9 +222,10 @@ def canvas_preview_html():
         page = int(request.args.get('page', 1))
         page_size = int(request.args.get('page_size', 100))
         start = (page - 1) * page_size
+        bundle = current_engine.get_preview_bundle(start=start, limit=page_size, with_preview=False)
         return jsonify({
-            "html": current_engine.get_html_preview(start=start, limit=page_size),
-            "total_paragraphs": current_engine.get_paragraph_count(),
+            "html": bundle["html"],
+            "total_paragraphs": bundle["total"],
             "page": page,
             "page_size": page_size,
             "structure": current_engine.get_document_structure()
@@ -170,8 +243,8 @@ def canvas_upload_reference():
         if file.filename == '':
             return jsonify({"error": "No selected file"}), 400
         
-        content = file.read()
-        success, message = current_engine.add_reference_doc(io.BytesIO(content), file.filename)
+        file.stream.seek(0)
+        success, message = current_engine.add_reference_doc(file.stream, file.filename)
         
         if success:
             refs = current_engine.get_reference_list()
@@ -217,190 +290,397 @@ def canvas_reset():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@canvas_bp.route('/chat', methods=['POST'])
-def canvas_chat():
-    try:
-        data = request.get_json()
-        user_text = data.get("message")
-        model_config = data.get("model_config", {})
-        history = data.get("history", [])
-        selection_context = data.get("selection_context", [])
+# Worker pool for the independent retrieval steps of canvas_chat
+_CHAT_POOL = ThreadPoolExecutor(max_workers=4)
 
-        if not user_text:
-            return jsonify({"error": "Message required"}), 400
+def _build_main_doc_context(user_text: str, model_config: Dict[str, Any], total_paras: int, relevant_indices: Optional[List[Dict[str, Any]]] = None) -> str:
+    """relevant_indices: TOC selection already made by a batched relevance call, if any."""
+    if total_paras < 300:
+        # STRATEGY A: Small Doc -> Full Context Injection
+        logging.info(f"Adaptive Strategy: Small Doc ({total_paras} paras). Injecting FULL text.")
+        full_text = current_engine.get_all_content()
+        return f"銆愬綋鍓嶇紪杈戞枃妗ｏ紙鍏ㄦ枃锛夈:\n{full_text}\n"
 
-        # Create staging copy if needed
-        if not current_engine.staging_doc:
-            current_engine.create_staging_copy()
+    # STRATEGY B: Large Doc -> Coarse-to-Fine Retrieval
+    logging.info(f"Adaptive Strategy: Large Doc ({total_paras} paras). Using Retrieval.")
 
-        page = data.get("page", 1)
-        page_size = data.get("page_size", 100)
-        scope_range = data.get("scope_range") # [start, end]
-        
-        # Get context (Paginated or Scoped)
-        if scope_range and len(scope_range) == 2:
-            start_id, end_id = scope_range
-            logging.info(f"Using Scope Range: {start_id} - {end_id}")
-            # limit is relative to start, so calculate diff
-            # Actually get_preview_data slice logic: paragraphs[start : start + limit]
-            # so limit = end - start + 1
-            limit = end_id - start_id + 1
-            context = current_engine.get_preview_data(start=start_id, limit=limit)
+    # 1. Get Main Doc Structure
+    main_structure = current_engine.get_document_structure()
+
+    # 2. Analyze Relevance via LLM (Reuse logic)
+    if main_structure:
+        if relevant_indices is None:
+            relevant_indices = llm_engine.analyze_toc_relevance(user_text, main_structure, model_config)
+        if relevant_indices:
+            retrieved_content = current_engine.get_content_by_indices(relevant_indices)
+            if retrieved_content:
+                return f"銆愭枃妗ｇ浉鍏崇珷鑺傦紙鏅鸿兘妫绱級銆:\n{retrieved_content}\n"
+    return ""
+
+# Reference context per (normalized question, reference set, provider, model);
+# a repeated question against unchanged references skips the TOC-relevance LLM call.
+# Entries expire after a short TTL so a keyword-fallback context (LLM error) is not
+# replayed until the references change.
+_REF_CONTEXT_CACHE: "OrderedDict[tuple, tuple]" = OrderedDict()
+_REF_CONTEXT_CACHE_SIZE = 256
+_REF_CONTEXT_CACHE_TTL = 300
+_REF_CONTEXT_CACHE_LOCK = threading.Lock()
+
+def _ref_cache_key(user_text: str, model_config: Dict[str, Any]) -> tuple:
+    return (
+        " ".join(user_text.lower().split()),
+        current_engine.get_reference_fingerprint(),
+        (model_config or {}).get("provider"),
+        (model_config or {}).get("model"),
+    )
+
+def _build_ref_context(user_text: str, model_config: Dict[str, Any], toc_selection: Optional[List[Dict[str, Any]]] = None) -> str:
+    cache_key = _ref_cache_key(user_text, model_config)
+    now = time.monotonic()
+    with _REF_CONTEXT_CACHE_LOCK:
+        entry = _REF_CONTEXT_CACHE.get(cache_key)
+        if entry is not None:
+            if now - entry[0] <= _REF_CONTEXT_CACHE_TTL:
+                _REF_CONTEXT_CACHE.move_to_end(cache_key)
+                return entry[1]
+            del _REF_CONTEXT_CACHE[cache_key]
+
+    final_ref_context = _retrieve_ref_context(user_text, model_config, toc_selection)
+
+    with _REF_CONTEXT_CACHE_LOCK:
+        _REF_CONTEXT_CACHE[cache_key] = (now, final_ref_context)
+        _REF_CONTEXT_CACHE.move_to_end(cache_key)
+        if len(_REF_CONTEXT_CACHE) > _REF_CONTEXT_CACHE_SIZE:
+            _REF_CONTEXT_CACHE.popitem(last=False)
+    return final_ref_context
+
+# Cheap local pre-filter in front of analyze_toc_relevance: CJK runs become
+# character bigrams, latin/digit runs whole lowercase words.
+_TOKEN_RE = re.compile(r'[\u4e00-\u9fff]+|[a-z0-9]+')
+_CHAT_STOPWORDS = {
+    "继续", "谢谢", "感谢", "你好", "好的", "可以", "请问", "一下", "什么", "这个",
+    "那个", "帮我", "我们", "一个", "怎么", "如何", "是否", "没有", "还有", "然后",
+    "ok", "thanks", "thank", "yes", "no", "hi", "hello",
+}
+_MAX_TITLE_MATCHES = 5
+# (reference fingerprint, [(toc item, title tokens)])
+_REF_TITLE_INDEX: tuple = (None, [])
+
+def _text_tokens(text: str) -> set:
+    tokens = set()
+    for run in _TOKEN_RE.findall(text.lower()):
+        if run.isascii():
+            if len(run) > 1:
+                tokens.add(run)
         else:
-            # Fallback to current page
-            start = (page - 1) * page_size
-            context = current_engine.get_preview_data(start=start, limit=page_size)
-        
-        # --- UNIVERSAL ADAPTIVE STRATEGY (MAIN DOC) ---
-        total_paras = current_engine.get_paragraph_count()
-        main_doc_context = ""
-        is_short_doc = total_paras < 300
-        
-        if is_short_doc:
-            # STRATEGY A: Small Doc -> Full Context Injection
-            logging.info(f"Adaptive Strategy: Small Doc ({total_paras} paras). Injecting FULL text.")
-            full_text = current_engine.get_all_content()
-            main_doc_context = f"銆愬綋鍓嶇紪杈戞枃妗ｏ紙鍏ㄦ枃锛夈:\n{full_text}\n"
+            tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens - _CHAT_STOPWORDS
+
+def _match_ref_titles(query_tokens: set, ref_structure: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Returns the TOC items whose titles share the most tokens with the query
+    (at most _MAX_TITLE_MATCHES), or [] when no title overlaps.
+    """
+    global _REF_TITLE_INDEX
+    fingerprint = current_engine.get_reference_fingerprint()
+    if _REF_TITLE_INDEX[0] != fingerprint:
+        _REF_TITLE_INDEX = (fingerprint, [(item, _text_tokens(item.get('title', ''))) for item in ref_structure])
+
+    scored = []
+    for item, title_tokens in _REF_TITLE_INDEX[1]:
+        overlap = len(query_tokens & title_tokens)
+        if overlap:
+            scored.append((overlap, item))
+    if not scored:
+        return []
+    best = max(overlap for overlap, _ in scored)
+    return [item for overlap, item in scored if overlap == best][:_MAX_TITLE_MATCHES]
+
+def _needs_ref_toc_analysis(user_text: str, model_config: Dict[str, Any]) -> bool:
+    """
+    True when _build_ref_context would end up calling analyze_toc_relevance:
+    not cached, references loaded, and neither a title match nor small talk.
+    """
+    with _REF_CONTEXT_CACHE_LOCK:
+        entry = _REF_CONTEXT_CACHE.get(_ref_cache_key(user_text, model_config))
+        if entry is not None and time.monotonic() - entry[0] <= _REF_CONTEXT_CACHE_TTL:
+            return False
+    ref_structure = current_engine.get_reference_structure()
+    if not ref_structure:
+        return False
+    query_tokens = _text_tokens(user_text)
+    if not query_tokens or len(user_text.strip()) < 6:
+        return False
+    return not _match_ref_titles(query_tokens, ref_structure)
+
+# Character budget for the combined reference TOC + retrieved sections
+_REF_CONTEXT_CHAR_LIMIT = 25000
+
+def _retrieve_ref_context(user_text: str, model_config: Dict[str, Any], toc_selection: Optional[List[Dict[str, Any]]] = None) -> str:
+    # Ref Context (Already Adaptive via docx_engine.get_relevant_reference_context upgrades)
+    # analyze_toc_relevance picks sections first; if it returns nothing, we trust the engine.
+    ref_structure = current_engine.get_reference_structure()
+    ref_context_str = ""
+
+    # Prepare TOC Summary
+    ref_toc_summary = ""
+    if ref_structure:
+        # Re-implement inline for safety
+        parts = ["\n銆愬弬鑰冩枃妗ｇ洰褰曠粨鏋勩:\n"]
+        current_doc_idx = -1
+        last_level, indent = 1, ""
+        for item in ref_structure:
+            if item.get('doc_idx') != current_doc_idx:
+                current_doc_idx = item.get('doc_idx')
+                parts.append(f"[鏂囨。: {item.get('filename')}]\n")
+            level = item.get('level', 1)
+            if level != last_level:
+                last_level, indent = level, "  " * (level - 1)
+            parts.append(f"{indent}- {item.get('title')}\n")
+        ref_toc_summary = "".join(parts)
+
+    # Execute Ref Retrieval
+    if ref_structure:
+        query_tokens = _text_tokens(user_text)
+        title_matches = _match_ref_titles(query_tokens, ref_structure) if query_tokens else []
+        if title_matches:
+            # Query names a section directly: no need for the TOC-relevance LLM call
+            logging.info(f"Ref Retrieval: {len(title_matches)} title match(es), skipping TOC analysis.")
+            ref_context_str = current_engine.get_content_by_indices(title_matches)
+        elif len(user_text.strip()) < 6 or not query_tokens:
+            # Small talk ("继续", "谢谢"): the TOC summary is enough
+            logging.info("Ref Retrieval: no content words in query, skipping retrieval.")
         else:
-            # STRATEGY B: Large Doc -> Coarse-to-Fine Retrieval
-            logging.info(f"Adaptive Strategy: Large Doc ({total_paras} paras). Using Retrieval.")
-            
-            # 1. Get Main Doc Structure
-            main_structure = current_engine.get_document_structure()
-            
-            # 2. Analyze Relevance via LLM (Reuse logic)
-            if main_structure:
-                relevant_indices = llm_engine.analyze_toc_relevance(user_text, main_structure, model_config)
-                if relevant_indices:
-                    retrieved_content = current_engine.get_content_by_indices(relevant_indices)
-                    if retrieved_content:
-                        main_doc_context = f"銆愭枃妗ｇ浉鍏崇珷鑺傦紙鏅鸿兘妫绱級銆:\n{retrieved_content}\n"
-
-        # Ref Context (Already Adaptive via docx_engine.get_relevant_reference_context upgrades)
-        # We still need to call it.
-        # But notice: current_engine.get_relevant_reference_context was updated to be adaptive.
-        # However, the code below used llm_engine.analyze_toc_relevance FIRST.
-        # We need to respect the internal adaptive logic of get_relevant_reference_context if we fallback?
-        # Actually, let's simplify Reference Logic to rely on the Engine's new smarts?
-        # Or keep the TOC analysis?
-        # The prompt said: "modify routes.py ... to apply threshold logic check".
-        # Since we updated get_relevant_reference_context to handle small docs, we can rely on it
-        # BUT analyze_toc_relevance is powerful.
-        # Let's keep analyze_toc_relevance but maybe we assume the Engine handles the choice?
-        # For now, let's keep the existing flow but if it returns nothing, we trust the engine.
-        
-        # Get reference context
-        ref_structure = current_engine.get_reference_structure()
-        ref_context_str = ""
-        
-        # Prepare TOC Summary
-        ref_toc_summary = ""
-        if ref_structure:
-            # Re-implement inline for safety
-            ref_toc_summary = "\n銆愬弬鑰冩枃妗ｇ洰褰曠粨鏋勩:\n"
-            current_doc_idx = -1
-            for item in ref_structure:
-                if item.get('doc_idx') != current_doc_idx:
-                    current_doc_idx = item.get('doc_idx')
-                    ref_toc_summary += f"[鏂囨。: {item.get('filename')}]\n"
-                indent = "  " * (item.get('level', 1) - 1)
-                ref_toc_summary += f"{indent}- {item.get('title')}\n"
-
-        # Execute Ref Retrieval
-        if ref_structure:
-            valid_indices = llm_engine.analyze_toc_relevance(user_text, ref_structure, model_config)
+            valid_indices = toc_selection
+            if valid_indices is None:
+                valid_indices = llm_engine.analyze_toc_relevance(user_text, ref_structure, model_config)
             if valid_indices:
                 ref_context_str = current_engine.get_content_by_indices(valid_indices)
             else:
                 ref_context_str = current_engine.get_relevant_reference_context(user_text)
-        else:
-            ref_context_str = current_engine.get_relevant_reference_context(user_text)
+    else:
+        ref_context_str = current_engine.get_relevant_reference_context(user_text)
 
+    # Combine Contexts; when over the limit, slice the parts first instead of
+    # building the full oversized concatenation and then copying a prefix of it
+    sep = "\n" if ref_context_str else ""
+    if len(ref_toc_summary) + len(sep) + len(ref_context_str) <= _REF_CONTEXT_CHAR_LIMIT:
+        return ref_toc_summary + sep + ref_context_str
+    head = (ref_toc_summary + sep)[:_REF_CONTEXT_CHAR_LIMIT]
+    final_ref_context = head + ref_context_str[:_REF_CONTEXT_CHAR_LIMIT - len(head)] + "\n...[鍙傝冭祫鏂欐埅鏂璢..."
+    return final_ref_context
 
-        # Combine Contexts
-        final_ref_context = (ref_toc_summary + "\n" + ref_context_str) if ref_context_str else ref_toc_summary
-        if len(final_ref_context) > 25000:
-             final_ref_context = final_ref_context[:25000] + "\n...[鍙傝冭祫鏂欐埅鏂璢..."
+def _prepare_chat(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Shared by /chat and /chat_stream: gathers the visible page plus main-doc,
+    reference and global context, and returns the keyword arguments for
+    llm_engine.chat_with_doc / chat_with_doc_stream.
+    """
+    user_text = data.get("message")
+    model_config = data.get("model_config", {})
 
-        # Get Global Context (Meta-Summary) if not full doc
-        global_context = ""
-        if not is_short_doc:
-             global_context = current_engine.get_global_context()
+    page = data.get("page", 1)
+    page_size = data.get("page_size", 100)
+    scope_range = data.get("scope_range") # [start, end]
+    
+    # Get context (Paginated or Scoped)
+    if scope_range and len(scope_range) == 2:
+        start_id, end_id = scope_range
+        logging.info(f"Using Scope Range: {start_id} - {end_id}")
+        # limit is relative to start, so calculate diff
+        # Actually get_preview_data slice logic: paragraphs[start : start + limit]
+        # so limit = end - start + 1
+        limit = end_id - start_id + 1
+        context = current_engine.get_preview_data(start=start_id, limit=limit)
+    else:
+        # Fallback to current page
+        start = (page - 1) * page_size
+        context = current_engine.get_preview_data(start=start, limit=page_size)
+    
+    # --- UNIVERSAL ADAPTIVE STRATEGY (MAIN DOC) ---
+    total_paras = current_engine.get_paragraph_count()
+    is_short_doc = total_paras < 300
 
-        # Construct Final User Message
-        # Priority: Main Doc Context -> Global Context -> Original User Text
-        
-        augmented_user_text = ""
-        if global_context:
-            augmented_user_text += f"銆愬叏涔﹁剦缁溿:\n{global_context}\n\n"
-        
-        if main_doc_context:
-            augmented_user_text += main_doc_context + "\n\n"
-            
-        augmented_user_text += f"銆愬綋鍓嶅彲瑙嗗尯鍩熴:\n(瑙 doc_context)\n\n銆愮敤鎴锋寚浠ゃ:\n{user_text}"
+    # Get Global Context (Meta-Summary) if not full doc
+    global_future = None if is_short_doc else _CHAT_POOL.submit(current_engine.get_global_context)
 
-        # Call LLM
-        response = llm_engine.chat_with_doc(
-            user_message=augmented_user_text, 
-            doc_context=context, # Visual Page context
-            ref_context=final_ref_context, 
-            model_config=model_config,
-            history=history,
-            selection_context=selection_context
-        )
+    # When both the main doc and the references need an LLM relevance pass over
+    # their TOC, ask for both selections in one request instead of two.
+    main_selection = ref_selection = None
+    if not is_short_doc and _needs_ref_toc_analysis(user_text, model_config):
+        main_structure = current_engine.get_document_structure()
+        if main_structure:
+            selections = llm_engine.analyze_toc_relevance_batch(
+                user_text,
+                [("main", main_structure), ("ref", current_engine.get_reference_structure())],
+                model_config
+            )
+            main_selection, ref_selection = selections["main"], selections["ref"]
 
-        intent = response.get("intent")
-        reply = response.get("reply") or ""
-        code = response.get("code")
-        
-        is_staging = False
+    # Main-doc retrieval, reference retrieval and the global summary are independent
+    # of each other; run them concurrently so their LLM round-trips overlap.
+    main_future = _CHAT_POOL.submit(_build_main_doc_context, user_text, model_config, total_paras, main_selection)
+    ref_future = _CHAT_POOL.submit(_build_ref_context, user_text, model_config, ref_selection)
+
+    main_doc_context = main_future.result()
+    final_ref_context = ref_future.result()
+    global_context = global_future.result() if global_future else ""
+
+    # Construct Final User Message
+    # Priority: Main Doc Context -> Global Context -> Original User Text
+    
+    augmented_user_text = ""
+    if global_context:
+        augmented_user_text += f"銆愬叏涔﹁剦缁溿:\n{global_context}\n\n"
+    
+    if main_doc_context:
+        augmented_user_text += main_doc_context + "\n\n"
         
-        if intent == "MODIFY":
-            if code:
-                # --- AGENTIC LOOP ---
-                # Instead of running once, we use the Agent to ensure success (Self-Correction)
-                agent = CanvasAgent(llm_engine, current_engine)
-                
-                # Pass the initial code (Draft) to the agent
-                result = agent.run_modification_loop(
-                    instruction=user_text,
-                    doc_context=context,
-                    model_config=model_config,
-                    initial_code=code
-                )
-                
-                if result["success"]:
-                    is_staging = True
-                    reply = result.get("reply", reply)
-                    # Preview is already updated in engine by execution
-                else:
-                    intent = "CHAT" # Fallback
-                    reply = f"{reply}\n\n(Agent failed to execute changes: {result.get('error')})"
+    augmented_user_text += f"銆愬綋鍓嶅彲瑙嗗尯鍩熴:\n(瑙 doc_context)\n\n銆愮敤鎴锋寚浠ゃ:\n{user_text}"
+
+    return {
+        "user_message": augmented_user_text,
+        "doc_context": context, # Visual Page context
+        "ref_context": final_ref_context,
+        "model_config": model_config,
+        "history": data.get("history", []),
+        "selection_context": data.get("selection_context", [])
+    }
+
+def _apply_chat_response(response: Dict[str, Any], user_text: str, chat_kwargs: Dict[str, Any]):
+    """
+    Runs the modification agent for MODIFY replies.
+    Returns (intent, reply, is_staging).
+    """
+    intent = response.get("intent")
+    reply = response.get("reply") or ""
+    code = response.get("code")
+    
+    is_staging = False
+    
+    if intent == "MODIFY":
+        if code:
+            # Staging copy (a full save + reparse) is only made once a reply actually
+            # modifies the document; CHAT turns read the committed doc, which is identical
+            if not current_engine.staging_doc:
+                current_engine.create_staging_copy()
+
+            # --- AGENTIC LOOP ---
+            # Instead of running once, we use the Agent to ensure success (Self-Correction)
+            agent = CanvasAgent(llm_engine, current_engine)
+            
+            # Pass the initial code (Draft) to the agent
+            result = agent.run_modification_loop(
+                instruction=user_text,
+                doc_context=chat_kwargs["doc_context"],
+                model_config=chat_kwargs["model_config"],
+                initial_code=code
+            )
+            
+            if result["success"]:
+                is_staging = True
+                reply = result.get("reply", reply)
+                # Preview is already updated in engine by execution
             else:
-                intent = "CHAT"
+                intent = "CHAT" # Fallback
+                reply = f"{reply}\n\n(Agent failed to execute changes: {result.get('error')})"
+        else:
+            intent = "CHAT"
+
+    return intent, reply, is_staging
+
+@canvas_bp.route('/chat', methods=['POST'])
+def canvas_chat():
+    try:
+        data = request.get_json()
+        user_text = data.get("message")
+
+        if not user_text:
+            return jsonify({"error": "Message required"}), 400
+
+        chat_kwargs = _prepare_chat(data)
+
+        # Call LLM
+        response = llm_engine.chat_with_doc(**chat_kwargs)
+        intent, reply, is_staging = _apply_chat_response(response, user_text, chat_kwargs)
+        # Non-MODIFY turns leave the document as the client last saw it
+        preview_fields = _preview_fields(_wants_html()) if intent == "MODIFY" else {}
         
         return jsonify({
             "message": "Processed", 
             "reply": reply,
             "intent": intent,
-            "preview": current_engine.get_preview_data(),
-            "html_preview": current_engine.get_html_preview(),
+            **preview_fields,
             "is_staging": is_staging
         })
     except Exception as e:
         logging.error(f"Canvas Chat Error: {e}")
         return jsonify({"error": str(e)}), 500
 
+@canvas_bp.route('/chat_stream', methods=['POST'])
+def canvas_chat_stream():
+    """
+    Server-Sent Events variant of /chat.
+    Emits {"status": "retrieving"} immediately, {"delta": "..."} events while
+    the LLM is generating, then a final {"done": true, ...} event carrying the
+    same fields /chat returns.
+    """
+    data = request.get_json() or {}
+    user_text = data.get("message")
+
+    if not user_text:
+        return jsonify({"error": "Message required"}), 400
+
+    include_html = _wants_html()
+
+    def _sse(payload: Dict[str, Any]) -> str:
+        # Same (orjson) provider as jsonify; the done event carries the full preview
+        return f"data: {current_app.json.dumps(payload)}\n\n"
+
+    def generate():
+        # First byte goes out before retrieval, which may itself wait on LLM calls
+        yield _sse({"status": "retrieving"})
+        try:
+            chat_kwargs = _prepare_chat(data)
+
+            chunks = []
+            for delta in llm_engine.chat_with_doc_stream(**chat_kwargs):
+                chunks.append(delta)
+                yield _sse({"delta": delta})
+
+            response = llm_engine.parse_chat_result("".join(chunks))
+            intent, reply, is_staging = _apply_chat_response(response, user_text, chat_kwargs)
+            preview_fields = _preview_fields(include_html) if intent == "MODIFY" else {}
+
+            yield _sse({
+                "done": True,
+                "message": "Processed",
+                "reply": reply,
+                "intent": intent,
+                **preview_fields,
+                "is_staging": is_staging
+            })
+        except Exception as e:
+            logging.error(f"Canvas Chat Stream Error: {e}")
+            yield _sse({"error": str(e)})
+
+    # Keep reverse proxies (nginx) and caches from buffering the event stream
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @canvas_bp.route('/confirm', methods=['POST'])
 def canvas_confirm():
     try:
         success = current_engine.commit_staging()
         if not success:
             return jsonify({"error": "No pending changes to confirm"}), 400
+        preview_fields = _preview_fields(_wants_html())
         return jsonify({
             "message": "Changes confirmed",
-            "preview": current_engine.get_preview_data(),
-            "html_preview": current_engine.get_html_preview()
+            **preview_fields
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -409,10 +689,10 @@ def canvas_confirm():
 def canvas_discard():
     try:
         current_engine.discard_staging()
+        preview_fields = _preview_fields(_wants_html())
         return jsonify({
             "message": "Changes discarded",
-            "preview": current_engine.get_preview_data(),
-            "html_preview": current_engine.get_html_preview()
+            **preview_fields
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -420,48 +700,49 @@ def canvas_discard():
 @canvas_bp.route('/download', methods=['GET'])
 def canvas_download():
     try:
-        stream = current_engine.save_to_stream()
-        return send_file(
-            stream, 
-            mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            as_attachment=True,
-            download_name="modified.docx"
-        )
+        # conditional + etag: an unchanged document is answered with 304
+        return _send_docx_file(current_engine.save_copy, "modified.docx")
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @canvas_bp.route('/export_pdf', methods=['GET'])
 def canvas_export_pdf():
     try:
-        engine = WordAppEngine()
-        # Pre-check connection
-        if not engine.connect():
+        # Pre-check connection (starts the shared Word instance on first use)
+        try:
+            run_with_word(lambda engine: True)
+        except RuntimeError:
              return jsonify({"error": "Failed to connect to Word. Please ensure Word is installed on the server."}), 500
         
         # 1. Save current doc to a temporary file
-        base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # backend/
-        temp_dir = os.path.join(base_dir, 'static', 'temp')
-        if not os.path.exists(temp_dir): os.makedirs(temp_dir, exist_ok=True)
-        
-        import uuid
         unique_id = uuid.uuid4()
-        docx_path = os.path.join(temp_dir, f"temp_{unique_id}.docx")
-        pdf_path = os.path.join(temp_dir, f"export_{unique_id}.pdf")
+        docx_path = os.path.join(_TEMP_DIR, f"temp_{unique_id}.docx")
+        pdf_path = os.path.join(_TEMP_DIR, f"export_{unique_id}.pdf")
         
-        current_engine.save_to_path(docx_path)
-        
-        # 2. Convert to PDF
-        success = engine.export_to_pdf(docx_path, pdf_path)
-        engine.quit() # Always cleanup
+        try:
+            current_engine.save_to_path(docx_path)
+            
+            # 2. Convert to PDF
+            success = run_with_word(lambda engine: engine.export_to_pdf(docx_path, pdf_path))
+        finally:
+            _remove_temp_file(docx_path)
         
         if success and os.path.exists(pdf_path):
-             return send_file(
-                pdf_path, 
-                mimetype="application/pdf",
-                as_attachment=True, 
-                download_name="document.pdf"
-             )
+             try:
+                 response = send_file(
+                    pdf_path, 
+                    mimetype="application/pdf",
+                    as_attachment=True, 
+                    download_name="document.pdf"
+                 )
+             except Exception:
+                 _remove_temp_file(pdf_path)
+                 raise
+             # Delete the PDF once the response has been fully sent
+             response.call_on_close(functools.partial(_remove_temp_file, pdf_path))
+             return response
         else:
+             _remove_temp_file(pdf_path)
              return jsonify({"error": "PDF conversion failed in Word engine."}), 500
              
     except Exception as e:
@@ -471,34 +752,33 @@ def canvas_export_pdf():
 @canvas_bp.route('/update_toc', methods=['POST'])
 def canvas_update_toc():
     try:
-        engine = WordAppEngine()
-        if not engine.connect():
+        try:
+            run_with_word(lambda engine: True)
+        except RuntimeError:
              return jsonify({"error": "Failed to connect to Word."}), 500
              
         # 1. Save current state
-        base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-        temp_dir = os.path.join(base_dir, 'static', 'temp')
-        if not os.path.exists(temp_dir): os.makedirs(temp_dir, exist_ok=True)
-        
-        import uuid
         unique_id = uuid.uuid4()
-        docx_path = os.path.join(temp_dir, f"temp_toc_{unique_id}.docx")
-        
-        current_engine.save_to_path(docx_path)
+        docx_path = os.path.join(_TEMP_DIR, f"temp_toc_{unique_id}.docx")
         
-        # 2. Update TOC
-        success = engine.update_toc(docx_path)
-        engine.quit()
+        try:
+            current_engine.save_to_path(docx_path)
+            
+            # 2. Update TOC
+            success = run_with_word(lambda engine: engine.update_toc(docx_path))
+            
+            if success:
+                 # Reload the updated doc back into current_engine (python-docx reads the file object directly)
+                 with open(docx_path, "rb") as f:
+                     current_engine.load_document(f)
+        finally:
+            _remove_temp_file(docx_path)
         
         if success:
-             # Reload the updated doc back into current_engine
-             with open(docx_path, "rb") as f:
-                 current_engine.load_document(io.BytesIO(f.read()))
-                 
+             preview_fields = _preview_fields(_wants_html())
              return jsonify({
                 "message": "TOC and Page Numbers updated successfully.",
-                "preview": current_engine.get_preview_data(),
-                "html_preview": current_engine.get_html_preview()
+                **preview_fields
              })
         else:
              return jsonify({"error": "Word engine failed to verify TOC updates."}), 500
@@ -522,16 +802,16 @@ def canvas_format_official():
         force_unbold = data.get("force_unbold", False)
         code = llm_engine.generate_formatting_code(context, model_config, scope, processor, force_unbold)
         
-        success, error_msg = current_engine.execute_code(code)
+        success, error_msg, _ = current_engine.execute_code(code)
         
         if not success:
              return jsonify({"error": f"Failed to execute formatting code: {error_msg}"}), 400
 
+        preview_fields = _preview_fields(_wants_html())
         return jsonify({
             "message": "Formatting applied", 
             "code_executed": code,
-            "preview": current_engine.get_preview_data(),
-            "html_preview": current_engine.get_html_preview(),
+            **preview_fields,
             "is_staging": True
         })
     except Exception as e:
@@ -552,41 +832,62 @@ def canvas_modify_local():
         context = current_engine.get_preview_data()
         code = llm_engine.generate_code(instruction, context)
         
-        success, error_msg = current_engine.execute_code(code)
+        success, error_msg, _ = current_engine.execute_code(code)
         if not success:
              return jsonify({"error": f"Failed to execute AI code: {error_msg}"}), 500
         
         current_engine.save_to_path(file_path)
+        preview_fields = _preview_fields(_wants_html())
         
         return jsonify({
             "message": "File processed and saved",
             "file_path": file_path,
-            "preview": current_engine.get_preview_data(),
-             "html_preview": current_engine.get_html_preview()
+            **preview_fields
         })
     except Exception as e:
         logging.error(f"Canvas Modify Local Error: {e}")
         return jsonify({"error": str(e)}), 500
 
+def _build_export_template() -> bytes:
+    doc = Document()
+    section = doc.sections[0]
+    section.top_margin = Cm(3.7)
+    section.bottom_margin = Cm(3.5)
+    section.left_margin = Cm(2.8)
+    section.right_margin = Cm(2.6)
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+# Empty document with the official page margins, saved once and reopened per export
+_EXPORT_TEMPLATE_BYTES = _build_export_template()
+# Length values are immutable and shared across paragraphs
+_FONT_SIZES = {16: Pt(16), 22: Pt(22)}
+_PT_28 = Pt(28)
+_CM_1_1 = Cm(1.1)
+_CM_15 = Cm(15)
+_QN_EAST_ASIA = qn('w:eastAsia')
+
+@functools.lru_cache(maxsize=256)
+def _load_image_bytes(path: str, mtime_ns: int) -> bytes:
+    # mtime_ns is part of the cache key so a replaced image is re-read
+    with open(path, 'rb') as f:
+        return f.read()
+
 @canvas_bp.route('/export_docx', methods=['POST'])
 def export_docs():
     data = request.json
     markdown_content = data.get('markdown', '')
 
     try:
-        doc = Document()
-        
-        # Setup Page Margins
-        section = doc.sections[0]
-        section.top_margin = Cm(3.7)
-        section.bottom_margin = Cm(3.5)
-        section.left_margin = Cm(2.8)
-        section.right_margin = Cm(2.6)
+        # Page margins are already set on the template
+        doc = Document(io.BytesIO(_EXPORT_TEMPLATE_BYTES))
 
         def set_font(run, font_name, size_pt, bold=False):
             run.font.name = font_name
-            run.font.size = Pt(size_pt)
-            run._element.rPr.rFonts.set(qn('w:eastAsia'), font_name)
+            run.font.size = _FONT_SIZES.get(size_pt) or Pt(size_pt)
+            # font.name above already created rPr/rFonts; write the East Asian slot directly
+            run._element.rPr.rFonts.set(_QN_EAST_ASIA, font_name)
             run.bold = bold
 
         lines = markdown_content.split('\n')
@@ -597,18 +898,26 @@ def export_docs():
             if not stripped_line:
                 continue
             
-            # Check for image: ![alt](/static/images/uuid.png)
-            img_match = re.search(r'!\[.*?\]\((.*?)\)', stripped_line)
-            if img_match:
-                img_url = img_match.group(1)
+            kind, payload = classify_line(stripped_line, not first_line_processed)
+
+            # Image: ![alt](/static/images/uuid.png)
+            if kind == "image":
+                img_url = payload
                 if '/static/images/' in img_url:
                     filename = img_url.split('/static/images/')[-1]
-                    img_path = os.path.join(current_app.root_path, 'static', 'images', filename)
+                    img_path = os.path.join(_IMAGES_DIR, filename)
+                    # One stat both checks existence and keys the image byte cache
+                    try:
+                        mtime_ns = os.stat(img_path).st_mtime_ns
+                    except OSError:
+                        mtime_ns = None
                     
-                    if os.path.exists(img_path):
+                    if mtime_ns is not None:
                         try:
-                            doc.add_picture(img_path, width=Cm(15))
-                            last_p = doc.paragraphs[-1] 
+                            # Same as doc.add_picture, but keeps the paragraph handle
+                            # instead of rebuilding doc.paragraphs to find it
+                            last_p = doc.add_paragraph()
+                            last_p.add_run().add_picture(io.BytesIO(_load_image_bytes(img_path, mtime_ns)), width=_CM_15)
                             last_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
                         except Exception as img_err:
                             logging.error(f"Failed to add image {img_path}: {img_err}")
@@ -617,12 +926,12 @@ def export_docs():
                         p = doc.add_paragraph(f"[鍥剧墖涓㈠け: {filename}]")
                 continue
 
-            clean_text = stripped_line.replace('*', '').replace('#', '').strip()
+            clean_text = payload
             
             p = doc.add_paragraph()
-            p.paragraph_format.line_spacing = Pt(28) 
+            p.paragraph_format.line_spacing = _PT_28 
 
-            if not first_line_processed:
+            if kind == "title":
                 # TITLE
                 p.alignment = WD_ALIGN_PARAGRAPH.CENTER
                 run = p.add_run(clean_text)
@@ -631,30 +940,18 @@ def export_docs():
             else:
                 p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
                 
-                is_l1 = re.match(r'^[涓浜屼笁鍥涗簲鍏竷鍏節鍗乚+銆', clean_text)
-                is_l2 = re.match(r'^锛圼涓浜屼笁鍥涗簲鍏竷鍏節鍗乚+锛', clean_text)
-                
-                if is_l1:
+                if kind == 'l1':
                     run = p.add_run(clean_text)
                     set_font(run, '榛戜綋', 16)
-                elif is_l2:
+                elif kind == 'l2':
                     run = p.add_run(clean_text)
                     set_font(run, '妤蜂綋_GB2312', 16)
                 else:
-                    p.paragraph_format.first_line_indent = Cm(1.1) 
+                    p.paragraph_format.first_line_indent = _CM_1_1 
                     run = p.add_run(clean_text)
                     set_font(run, '浠垮畫_GB2312', 16)
 
-        f = io.BytesIO()
-        doc.save(f)
-        f.seek(0)
-        
-        return send_file(
-            f, 
-            mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            as_attachment=True,
-            download_name="smart_export.docx"
-        )
+        return _send_docx_file(doc.save, "smart_export.docx")
     except Exception as e:
         logging.error(f"Smart Canvas Export Error: {e}")
 
@@ -683,6 +980,11 @@ def debug_state():
         return jsonify({"error": str(e)}), 500
 
 
+# Heading/body heuristics for export_smart_docx, applied to every block
+_SMART_H1_RE = re.compile(r"^[一二三四五六七八九十]+、")
+_SMART_H2_RE = re.compile(r"^（[一二三四五六七八九十]+）")
+_SMART_END_PUNCT_RE = re.compile(r"[。：；]$")
+
 @canvas_bp.route('/export-smart-docx', methods=['POST'])
 def export_smart_docx():
     try:
@@ -700,8 +1002,8 @@ def export_smart_docx():
 
         def set_font(run, font_name, size_pt, bold=False):
             run.font.name = font_name
-            run.font.size = Pt(size_pt)
-            run._element.rPr.rFonts.set(qn('w:eastAsia'), font_name)
+            run.font.size = _FONT_SIZES.get(size_pt) or Pt(size_pt)
+            run._element.rPr.rFonts.set(_QN_EAST_ASIA, font_name)
             run.bold = bold
 
         # Helper to extract text from a node
@@ -723,10 +1025,11 @@ def export_smart_docx():
              level = attrs.get('level')
              
              # Heuristic Detection
-             is_h1_text = re.match(r"^[一二三四五六七八九十]+、", text.strip())
-             is_h2_text = re.match(r"^（[一二三四五六七八九十]+）", text.strip())
-             ends_with_punct = re.search(r"[。：；]$", text.strip())
-             is_long_text = len(text.strip()) > 50
+             stripped = text.strip()
+             is_h1_text = _SMART_H1_RE.match(stripped)
+             is_h2_text = _SMART_H2_RE.match(stripped)
+             ends_with_punct = _SMART_END_PUNCT_RE.search(stripped)
+             is_long_text = len(stripped) > 50
 
              # Determine if Body has started
              # If we hit a Heading or Body-like text, the Title block ends
@@ -765,16 +1068,7 @@ def export_smart_docx():
                  run = p.add_run(text)
                  set_font(run, '方正仿宋_GBK', 16, bold=False)
 
-        f = io.BytesIO()
-        doc.save(f)
-        f.seek(0)
-        
-        return send_file(
-            f, 
-            mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            as_attachment=True,
-            download_name="smart_export.docx"
-        )
+        return _send_docx_file(doc.save, "smart_export.docx")
     except Exception as e:
         logging.error(f"Smart Export Error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -2,16 +2,38 @@
 Canvas Converter: Tiptap JSON ↔ DOCX 双向转换
 为快速画布和专业画布提供无缝数据互通
 """
+import copy
 import io
 import logging
-from typing import Dict, Any, List
+import tempfile
+from typing import Dict, Any, IO, List
 from docx import Document
+from docx.document import Document as _Document
+from docx.oxml.text.paragraph import CT_P
+from docx.oxml.table import CT_Tbl
+from docx.table import _Cell, Table
+from docx.text.paragraph import Paragraph
 from docx.shared import Pt, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
 
 logger = logging.getLogger(__name__)
 
-def tiptap_to_docx(json_content: Dict[str, Any]) -> io.BytesIO:
+# 导出结果超过该大小时落盘，避免大文档整份驻留内存
+_SPOOL_MAX_SIZE = 1 << 20
+
+def _save_document(doc, spooled: bool = True) -> IO[bytes]:
+    """
+    保存文档并返回已回到开头的文件流
+    spooled=False 时返回 BytesIO：进程池需要把结果 pickle 回主进程，SpooledTemporaryFile 无法序列化
+    """
+    buffer = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE) if spooled else io.BytesIO()
+    doc.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+def tiptap_to_docx(json_content: Dict[str, Any], spooled: bool = True) -> IO[bytes]:
     """
     将Tiptap JSON转换为DOCX文件流
     
@@ -50,11 +72,10 @@ def tiptap_to_docx(json_content: Dict[str, Any]) -> io.BytesIO:
         elif block_type == 'orderedList':
             _process_list(doc, block, ordered=True)
     
-    # 返回BytesIO
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    return buffer
+    return _save_document(doc, spooled)
+
+# Tiptap 标记 -> run 上的布尔属性（strike 位于 run.font，单独处理）
+_RUN_MARK_ATTRS = {'bold': 'bold', 'italic': 'italic', 'underline': 'underline'}
 
 def _process_paragraph(doc: Document, block: Dict):
     """处理段落节点，应用文本标记"""
@@ -62,24 +83,26 @@ def _process_paragraph(doc: Document, block: Dict):
     content = block.get('content', [])
     
     for item in content:
-        if item.get('type') == 'text':
+        item_type = item.get('type')
+        if item_type == 'text':
             text = item.get('text', '')
+            # 空文本不生成 <w:r>
+            if not text:
+                continue
             run = para.add_run(text)
             
             # 应用标记
-            marks = item.get('marks', [])
-            for mark in marks:
-                mark_type = mark.get('type')
-                if mark_type == 'bold':
-                    run.bold = True
-                elif mark_type == 'italic':
-                    run.italic = True
-                elif mark_type == 'underline':
-                    run.underline = True
-                elif mark_type == 'strike':
-                    run.font.strike = True
+            marks = item.get('marks')
+            if marks:
+                for mark in marks:
+                    mark_type = mark.get('type')
+                    attr = _RUN_MARK_ATTRS.get(mark_type)
+                    if attr:
+                        setattr(run, attr, True)
+                    elif mark_type == 'strike':
+                        run.font.strike = True
         
-        elif item.get('type') == 'hardBreak':
+        elif item_type == 'hardBreak':
             para.add_run('\n')
 
 def _process_list(doc: Document, block: Dict, ordered: bool = False):
@@ -93,15 +116,17 @@ def _process_list(doc: Document, block: Dict, ordered: bool = False):
             doc.add_paragraph(prefix + text_content)
 
 def _extract_text(block: Dict) -> str:
-    """递归提取文本内容"""
-    content = block.get('content', [])
+    """按文档顺序提取全部文本内容（显式栈遍历，深层嵌套列表不受递归深度限制）"""
     text_parts = []
+    # 子节点逆序入栈，出栈顺序即文档顺序
+    stack = list(reversed(block.get('content', [])))
     
-    for item in content:
+    while stack:
+        item = stack.pop()
         if item.get('type') == 'text':
             text_parts.append(item.get('text', ''))
         elif 'content' in item:
-            text_parts.append(_extract_text(item))
+            stack.extend(reversed(item['content']))
     
     return ''.join(text_parts)
 
@@ -120,35 +145,10 @@ def docx_to_tiptap(file_stream: io.BytesIO) -> Dict[str, Any]:
     document = Document(file_stream)
     content = []
     
-    # Helper to iterate elements in order
-    from docx.document import Document as _Document
-    from docx.oxml.text.paragraph import CT_P
-    from docx.oxml.table import CT_Tbl
-    from docx.table import _Cell, Table
-    from docx.text.paragraph import Paragraph
-
-    def iter_block_items(parent):
-        """
-        Yield each paragraph and table child within *parent*, in document order.
-        Each returned value is an instance of either Table or Paragraph.
-        """
-        if isinstance(parent, _Document):
-            parent_elm = parent.element.body
-        elif isinstance(parent, _Cell):
-            parent_elm = parent._tc
-        else:
-            raise ValueError("something's not right")
-
-        for child in parent_elm.iterchildren():
-            if isinstance(child, CT_P):
-                yield Paragraph(child, parent)
-            elif isinstance(child, CT_Tbl):
-                yield Table(child, parent)
-
     count_para = 0
     count_table = 0
 
-    for block in iter_block_items(document):
+    for block in _iter_block_items(document):
         if isinstance(block, Paragraph):
             count_para += 1
             # Check style mainly for headings
@@ -167,21 +167,23 @@ def docx_to_tiptap(file_stream: io.BytesIO) -> Dict[str, Any]:
         
         elif isinstance(block, Table):
             count_table += 1
-            # Simple table extraction: convert rows to paragraphs
+            # Simple table extraction: one paragraph per non-empty cell,
+            # tagged with its position so the table can be regrouped later
             # TODO: Future support for actual Tiptap tables
-            for row in block.rows:
-                row_text = []
-                for cell in row.cells:
-                    cell_text = cell.text.strip()
-                    if cell_text:
-                        row_text.append(cell_text)
-                
-                if row_text:
-                    # Join cell text with separator
-                    line = " | ".join(row_text)
+            table_index = count_table - 1
+            for row_index, cell_texts in enumerate(_fast_table_rows(block._tbl)):
+                for col_index, cell_text in enumerate(cell_texts):
+                    cell_text = cell_text.strip()
+                    if not cell_text:
+                        continue
                     content.append({
                         "type": "paragraph",
-                        "content": [{"type": "text", "text": line}]
+                        "attrs": {"tableContext": {
+                            "tableIndex": table_index,
+                            "rowIndex": row_index,
+                            "colIndex": col_index
+                        }},
+                        "content": [{"type": "text", "text": cell_text}]
                     })
     
     print(f"[DEBUG] DOCX Import: {count_para} paragraphs, {count_table} tables parsed.")
@@ -189,14 +191,10 @@ def docx_to_tiptap(file_stream: io.BytesIO) -> Dict[str, Any]:
     # Fallback: If content is still empty (e.g. text boxes, weird formatting), extract raw text
     if not content:
         print("[DEBUG] Content empty after structural parse. Attempting raw text fallback.")
-        full_text = []
-        for element in document.element.body.iter():
-            if element.tag.endswith('t'):
-                if element.text:
-                    full_text.append(element.text)
+        # 只取 w:t，由 lxml 在 C 层按标签过滤
+        joined_text = "".join(t.text or '' for t in document.element.body.iter(_W_T))
         
-        if full_text:
-            joined_text = "".join(full_text)
+        if joined_text:
             # Create a single paragraph with all text
             content.append({
                 "type": "paragraph",
@@ -211,6 +209,42 @@ def docx_to_tiptap(file_stream: io.BytesIO) -> Dict[str, Any]:
         "content": content
     }
 
+def _iter_block_items(parent):
+    """
+    Yield each paragraph and table child within *parent*, in document order.
+    Each returned value is an instance of either Table or Paragraph.
+    """
+    if isinstance(parent, _Document):
+        parent_elm = parent.element.body
+    elif isinstance(parent, _Cell):
+        parent_elm = parent._tc
+    else:
+        raise ValueError("something's not right")
+
+    for child in parent_elm.iterchildren():
+        if isinstance(child, CT_P):
+            yield Paragraph(child, parent)
+        elif isinstance(child, CT_Tbl):
+            yield Table(child, parent)
+
+def _fast_table_rows(tbl):
+    """
+    逐行产出单元格文本列表，直接遍历 <w:tr>/<w:tc>。
+    table.rows / row.cells 每次访问都会重算合并单元格布局（行数的平方级），只读导入无需这些。
+    合并单元格只在其所在的 <w:tc> 出现一次，不会像 row.cells 那样重复。
+    """
+    for tr in tbl.tr_lst:
+        yield [''.join(t.text or '' for t in tc.iter(_W_T)) for tc in tr.tc_lst]
+
+_W_T = qn('w:t')
+
+def docx_to_tiptap_from_path(path: str) -> Dict[str, Any]:
+    """
+    docx_to_tiptap 的路径版本（供进程池调用，只需传递文件路径）
+    """
+    with open(path, 'rb') as f:
+        return docx_to_tiptap(f)
+
 def _para_to_tiptap(para) -> Dict:
     """将DOCX段落转换为Tiptap段落节点"""
     text_content = []
@@ -250,10 +284,18 @@ def _para_to_tiptap(para) -> Dict:
 # ==================== Smart Gov Export ====================
 
 import re
-from docx.oxml.ns import qn
 from docx.enum.text import WD_LINE_SPACING
 
-def tiptap_to_smart_docx(json_content: Dict[str, Any]) -> io.BytesIO:
+# 标题层级正则 (兼容更多格式，如全角空格)，模块加载时编译一次
+_SMART_H1_RE = re.compile(r"^\s*[一二三四五六七八九十]+、")
+_SMART_H2_RE = re.compile(r"^\s*[（(][一二三四五六七八九十]+[)）]")
+_SMART_H3_RE = re.compile(r"^\s*[0-9]+[.\u3002、 ]") # 1. 1。 1、 1 
+# 各级标题可能的首字符：正文段落首字符不在其中时直接跳过正则匹配
+_SMART_H1_FIRST = frozenset("一二三四五六七八九十")
+_SMART_H2_FIRST = frozenset("（(")
+_SMART_H3_FIRST = frozenset("0123456789")
+
+def tiptap_to_smart_docx(json_content: Dict[str, Any], spooled: bool = True) -> IO[bytes]:
     """
     智能公文格式导出
     规则：
@@ -268,18 +310,18 @@ def tiptap_to_smart_docx(json_content: Dict[str, Any]) -> io.BytesIO:
     style = doc.styles['Normal']
     style.font.name = '方正仿宋_GBK'
     style.element.rPr.rFonts.set(qn('w:eastAsia'), '方正仿宋_GBK')
+    style.element.rPr.rFonts.set(qn('w:cs'), '方正仿宋_GBK')
     style.paragraph_format.line_spacing_rule = WD_LINE_SPACING.EXACTLY
     style.paragraph_format.line_spacing = Pt(28)
     
     content = json_content.get('content', [])
     
-    # 正则表达式 (兼容更多格式，如全角空格)
-    re_h1 = re.compile(r"^\s*[一二三四五六七八九十]+、")
-    re_h2 = re.compile(r"^\s*[（(][一二三四五六七八九十]+[)）]")
-    re_h3 = re.compile(r"^\s*[0-9]+[.\u3002、 ]") # 1. 1。 1、 1 
-    
     for block in content:
-        # 提取纯文本用于判断
+        # 空段落（Tiptap 输出中很常见）无需遍历，直接跳过
+        if not block.get('content'):
+            continue
+        
+        # 提取纯文本用于判断；只含空白的块同样不生成段落
         full_text = _extract_text(block).strip()
         if not full_text:
             continue
@@ -289,24 +331,22 @@ def tiptap_to_smart_docx(json_content: Dict[str, Any]) -> io.BytesIO:
         # 默认作为正文处理
         p = doc.add_paragraph()
         
-        # 智能层级判断
-        if re_h1.match(full_text):
+        # 智能层级判断（full_text 已 strip，首字符即可区分三类标题）
+        first = full_text[0]
+        if first in _SMART_H1_FIRST and _SMART_H1_RE.match(full_text):
             # 一级标题：黑体，三号
             _set_run_style(p.add_run(full_text), '黑体', 16, bold=True)
-        elif re_h2.match(full_text):
+        elif first in _SMART_H2_FIRST and _SMART_H2_RE.match(full_text):
             # 二级标题：方正楷体_GBK，三号
             _set_run_style(p.add_run(full_text), '方正楷体_GBK', 16, bold=True)
-        elif re_h3.match(full_text):
+        elif first in _SMART_H3_FIRST and _SMART_H3_RE.match(full_text):
             # 三级标题：方正仿宋_GBK，三号
             _set_run_style(p.add_run(full_text), '方正仿宋_GBK', 16, bold=True)
         else:
             # 正文内容：方正仿宋_GBK，三号
             _process_paragraph_smart(p, block)
             
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    return buffer
+    return _save_document(doc, spooled)
 
 def _process_paragraph_smart(paragraph, block):
     """处理正文段落，保持原有加粗/斜体，但强制字体"""
@@ -314,36 +354,48 @@ def _process_paragraph_smart(paragraph, block):
     for item in content:
         if item.get('type') == 'text':
             text = item.get('text', '')
+            if not text:
+                continue
             run = paragraph.add_run(text)
             
+            marks = item.get('marks')
+            if not marks:
+                # 字体已由 Normal 样式给出（方正仿宋_GBK），无标记的 run 只需设置字号
+                run.font.size = Pt(16)
+                continue
+            
             # Apply base Gov Font (方正仿宋_GBK)
             _set_run_style(run, '方正仿宋_GBK', 16) 
             
             # Apply Marks (Overlay)
-            marks = item.get('marks', [])
             for mark in marks:
-                if mark.get('type') == 'bold': run.bold = True
-                if mark.get('type') == 'italic': run.italic = True
-                if mark.get('type') == 'underline': run.underline = True
+                attr = _RUN_MARK_ATTRS.get(mark.get('type'))
+                if attr:
+                    setattr(run, attr, True)
+
+# rFonts 上需要统一设置的四个字体属性（中文、西文、高位 ANSI、复杂文种）
+_RFONTS_ATTRS = tuple(qn(a) for a in ('w:eastAsia', 'w:ascii', 'w:hAnsi', 'w:cs'))
+# 每种字体预先构建一份 <w:rFonts>，新 run 直接深拷贝，不再逐个 set 属性
+_RFONTS_TEMPLATES: Dict[str, Any] = {}
+
+def _rfonts_template(font_name):
+    template = _RFONTS_TEMPLATES.get(font_name)
+    if template is None:
+        template = OxmlElement('w:rFonts', attrs=dict.fromkeys(_RFONTS_ATTRS, font_name))
+        _RFONTS_TEMPLATES[font_name] = template
+    return template
 
 def _set_run_style(run, font_name, size_pt, bold=False):
     """Helper to set Chinese font and size correctly for both ASCII and EastAsia"""
-    run.font.name = font_name
     run.font.size = Pt(size_pt)
     run.bold = bold
     
-    # 强制设置 XML 属性以确保中西文都使用该字体
+    # 强制设置 XML 属性以确保中西文都使用该字体（同时覆盖 run.font.name 设置的 ascii/hAnsi）
     rPr = run._element.get_or_add_rPr()
-    
-    # 清除可能存在的旧字体设置
-    # rFonts = rPr.find(qn('w:rFonts'))
-    # if rFonts is not None:
-    #     rPr.remove(rFonts)
-        
-    # 设置新的字体
-    rFonts = rPr.get_or_add_rFonts()
-    rFonts.set(qn('w:eastAsia'), font_name)
-    rFonts.set(qn('w:ascii'), font_name)
-    rFonts.set(qn('w:hAnsi'), font_name)
-    rFonts.set(qn('w:cs'), font_name) # Complex Script
+    rFonts = rPr.rFonts
+    if rFonts is None:
+        rPr._insert_rFonts(copy.deepcopy(_rfonts_template(font_name)))
+    else:
+        for attr in _RFONTS_ATTRS:
+            rFonts.set(attr, font_name)
 
@@ -9,6 +9,18 @@ from core.proxies import (
 
 common_bp = Blueprint('common', __name__)
 
+# provider -> (非流式处理函数, 流式处理函数)；OpenAI 兼容的服务共用同一组代理
+_OPENAI_COMPATIBLE = (call_openai_proxy, stream_openai_proxy)
+_PROVIDER_HANDLERS = {
+    'gemini': (call_gemini_openai_proxy, stream_gemini_openai_proxy),
+    'openai': _OPENAI_COMPATIBLE,
+    'free': _OPENAI_COMPATIBLE,
+    'depOCR': _OPENAI_COMPATIBLE,
+    'doubao': _OPENAI_COMPATIBLE,
+    'deepseek': (call_deepseek_proxy, stream_deepseek_proxy),
+    'ali': (call_ali_proxy, stream_ali_proxy),
+}
+
 @common_bp.route('/generate', methods=['POST']) 
 def handle_generate(): 
     try: 
@@ -16,16 +28,10 @@ def handle_generate():
         provider = data.get('provider') 
         logging.info(f"Received non-stream generation request, Provider: {provider}") 
         
-        if provider == 'gemini': 
-            return call_gemini_openai_proxy(data)
-        elif provider in ['openai', 'free', 'depOCR', 'doubao']: 
-            return call_openai_proxy(data) 
-        elif provider == 'deepseek': 
-            return call_deepseek_proxy(data) 
-        elif provider == 'ali': 
-            return call_ali_proxy(data) 
-        else: 
+        handlers = _PROVIDER_HANDLERS.get(provider) 
+        if handlers is None: 
             return jsonify({"error": f"Unsupported provider: {provider}"}), 400 
+        return handlers[0](data) 
     except Exception as e: 
         logging.error(f"API /generate error: {e}") 
         return jsonify({"error": str(e)}), 500 
@@ -42,16 +48,10 @@ def handle_generate_stream():
         
         logging.info(f"Received stream generation request, Provider: {provider}") 
 
-        if provider == 'gemini': 
-            return Response(stream_with_context(stream_gemini_openai_proxy(user_prompt, sys_inst, history, model_config)), content_type='text/plain') 
-        elif provider in ['openai', 'free', 'depOCR', 'doubao']: 
-            return Response(stream_with_context(stream_openai_proxy(user_prompt, sys_inst, history, model_config)), content_type='text/plain') 
-        elif provider == 'deepseek': 
-            return Response(stream_with_context(stream_deepseek_proxy(user_prompt, sys_inst, history, model_config)), content_type='text/plain') 
-        elif provider == 'ali': 
-            return Response(stream_with_context(stream_ali_proxy(user_prompt, sys_inst, history, model_config)), content_type='text/plain') 
-        else: 
+        handlers = _PROVIDER_HANDLERS.get(provider) 
+        if handlers is None: 
             return Response(stream_with_context([f"[Error: Unsupported provider: {provider}]"]), content_type='text/plain') 
+        return Response(stream_with_context(handlers[1](user_prompt, sys_inst, history, model_config)), content_type='text/plain') 
     except Exception as e: 
         return Response(stream_with_context([f"[Internal Error: {str(e)}]"]), content_type='text/plain')
 
@@ -5,6 +5,12 @@ AI 文件排序模块
 import logging
 from typing import List, Dict
 import json
+import numpy as np
+
+try:
+    import ahocorasick  # pyahocorasick：多关键词单遍匹配
+except ImportError:
+    ahocorasick = None
 
 logger = logging.getLogger(__name__)
 
@@ -31,45 +37,46 @@ def rank_files(query: str, files: List[Dict], max_results: int = 10) -> List[Dic
         排序后的文件列表（包含 ai_score 和 ai_reason 字段）
     """
     try:
-        # 为每个文件计算评分
-        scored_files = []
+        if not files:
+            return []
+        
         query_lower = query.lower()
-        query_keywords = set(query_lower.split())
+        query_keywords = list(set(query_lower.split()))
         
-        for file in files:
-            file_name = file.get('name', '').lower()
-            file_path = file.get('path', '').lower()
-            
-            # 计算各维度得分
-            name_score = _calculate_name_score(file_name, query_lower, query_keywords)
-            path_score = _calculate_path_score(file_path, query_keywords)
-            time_score = 0  # TODO: 基于修改时间计算
-            type_score = 0  # TODO: 基于文件类型计算
-            
-            # 加权总分
-            total_score = (
-                name_score * 0.4 +
-                path_score * 0.3 +
-                time_score * 0.2 +
-                type_score * 0.1
-            )
-            
-            # 生成推荐理由
-            reason = _generate_reason(file_name, file_path, query, name_score, path_score)
-            
-            # 添加评分信息到文件对象
+        # 文件名/路径统一小写一次，关键词命中在 NumPy 中逐列向量化计算
+        names = np.char.lower(np.array([file.get('name', '') for file in files]))
+        paths = np.char.lower(np.array([file.get('path', '') for file in files]))
+        
+        # 计算各维度得分（关键词较多时每个文本只扫一遍）
+        automaton = _build_keyword_automaton(query_keywords)
+        name_score = _name_scores(names, query_lower, query_keywords, automaton)
+        path_score = _path_scores(paths, query_keywords, automaton)
+        time_score = 0  # TODO: 基于修改时间计算
+        type_score = 0  # TODO: 基于文件类型计算
+        
+        # 加权总分
+        total_score = (
+            name_score * 0.4 +
+            path_score * 0.3 +
+            time_score * 0.2 +
+            type_score * 0.1
+        )
+        rounded_score = np.round(total_score, 2)
+        
+        # 只为前 N 个结果生成理由和副本（与原先排序后切片的顺序一致）
+        top_k = len(files[:max_results])
+        scored_files = []
+        for i in _top_k_indices(rounded_score, top_k).tolist():
+            file = files[i]
             file_with_score = file.copy()
-            file_with_score['ai_score'] = round(total_score, 2)
-            file_with_score['ai_reason'] = reason
-            file_with_score['is_recommended'] = total_score >= 70  # 分数 >= 70 标记为推荐
-            
+            file_with_score['ai_score'] = float(rounded_score[i])
+            file_with_score['ai_reason'] = _generate_reason(
+                names[i], paths[i], query, float(name_score[i]), float(path_score[i])
+            )
+            file_with_score['is_recommended'] = bool(total_score[i] >= 70)  # 分数 >= 70 标记为推荐
             scored_files.append(file_with_score)
         
-        # 按分数降序排序
-        scored_files.sort(key=lambda x: x['ai_score'], reverse=True)
-        
-        # 返回前 N 个结果
-        return scored_files[:max_results]
+        return scored_files
     
     except Exception as e:
         logger.error(f"File ranking failed: {e}")
@@ -77,7 +84,36 @@ def rank_files(query: str, files: List[Dict], max_results: int = 10) -> List[Dic
         return files[:max_results]
 
 
-def _calculate_name_score(file_name: str, query: str, query_keywords: set) -> float:
+# 关键词数达到该值且装有 pyahocorasick 时改用自动机；关键词少时逐列 np.char.find 更快
+_AUTOMATON_MIN_KEYWORDS = 4
+
+
+def _build_keyword_automaton(keywords: List[str]):
+    """为本次查询的关键词构建 Aho-Corasick 自动机；不可用或关键词太少时返回 None"""
+    if ahocorasick is None or len(keywords) < _AUTOMATON_MIN_KEYWORDS:
+        return None
+    automaton = ahocorasick.Automaton()
+    for kw in keywords:
+        automaton.add_word(kw, kw)
+    automaton.make_automaton()
+    return automaton
+
+
+def _keyword_hits(texts: np.ndarray, keywords: List[str], automaton=None) -> np.ndarray:
+    """每个文本命中的关键词个数（重叠的关键词各自计数）"""
+    if automaton is not None:
+        return np.fromiter(
+            (len({kw for _, kw in automaton.iter(text)}) for text in texts.tolist()),
+            dtype=np.int64,
+            count=len(texts)
+        )
+    hits = np.zeros(len(texts), dtype=np.int64)
+    for kw in keywords:
+        hits += np.char.find(texts, kw) >= 0
+    return hits
+
+
+def _name_scores(names: np.ndarray, query: str, query_keywords: List[str], automaton=None) -> np.ndarray:
     """
     计算文件名相关度得分（0-100）
     
@@ -88,30 +124,21 @@ def _calculate_name_score(file_name: str, query: str, query_keywords: set) -> fl
     - 包含部分关键词：40 分
     - 其他：20 分
     """
-    # 完全匹配
-    if query in file_name:
-        return 100.0
-    
-    # 检查关键词匹配
-    matched_keywords = sum(1 for kw in query_keywords if kw in file_name)
-    total_keywords = len(query_keywords)
-    
-    if total_keywords == 0:
-        return 20.0
-    
-    match_ratio = matched_keywords / total_keywords
-    
-    if match_ratio == 1.0:
-        return 80.0
-    elif match_ratio >= 0.5:
-        return 60.0
-    elif match_ratio > 0:
-        return 40.0
+    if not query_keywords:
+        scores = np.full(len(names), 20.0)
     else:
-        return 20.0
+        match_ratio = _keyword_hits(names, query_keywords, automaton) / len(query_keywords)
+        scores = np.select(
+            [match_ratio == 1.0, match_ratio >= 0.5, match_ratio > 0],
+            [80.0, 60.0, 40.0],
+            default=20.0
+        )
+    # 完全匹配优先
+    scores[np.char.find(names, query) >= 0] = 100.0
+    return scores
 
 
-def _calculate_path_score(file_path: str, query_keywords: set) -> float:
+def _path_scores(paths: np.ndarray, query_keywords: List[str], automaton=None) -> np.ndarray:
     """
     计算路径相关度得分（0-100）
     
@@ -119,14 +146,28 @@ def _calculate_path_score(file_path: str, query_keywords: set) -> float:
     - 路径中包含关键词越多，分数越高
     """
     if not query_keywords:
-        return 50.0
-    
-    matched_keywords = sum(1 for kw in query_keywords if kw in file_path)
-    match_ratio = matched_keywords / len(query_keywords)
-    
+        return np.full(len(paths), 50.0)
+    match_ratio = _keyword_hits(paths, query_keywords, automaton) / len(query_keywords)
     return match_ratio * 100
 
 
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    分数最高的 k 个下标，按分数降序；同分保持原始顺序（等价于稳定排序后取前 k 个）
+    用 np.partition 找到第 k 大的分数，只对入选的少量下标排序
+    """
+    n = len(scores)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k >= n:
+        return np.argsort(-scores, kind='stable')
+    threshold = np.partition(scores, n - k)[n - k]
+    above = np.flatnonzero(scores > threshold)
+    ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+    selected = np.concatenate((above, ties))
+    return selected[np.argsort(-scores[selected], kind='stable')]
+
+
 def _generate_reason(file_name: str, file_path: str, query: str, name_score: float, path_score: float) -> str:
     """
     生成推荐理由
@@ -2,6 +2,8 @@
 对话式文件搜索 Agent
 支持多轮对话、上下文理解、渐进式筛选
 """
+import copy
+import functools
 import logging
 from typing import List, Dict, Optional
 from features.file_search.search_agent import FileSearchAgent
@@ -91,30 +93,17 @@ class ConversationalSearchAgent(FileSearchAgent):
             搜索参数（可能结合了历史上下文）
         """
         try:
-            from core.llm_helper import call_llm
-            
-            # 准备历史记录文本
-            history_text = ""
-            if history:
-                for turn in history[-3:]:  # 只看最近3轮
-                    history_text += f"{turn.get('role', 'user')}: {turn.get('text', '')}\n"
-            
-            # 调用 LLM 理解上下文
-            prompt = self.CONTEXTUAL_PROMPT.format(
-                history=history_text or "无",
-                current_input=user_input
+            # 准备历史记录文本（只看最近3轮）
+            history_text = "".join(
+                f"{turn.get('role', 'user')}: {turn.get('text', '')}\n" for turn in (history or [])[-3:]
             )
             
-            response = call_llm(
-                provider=self.model_provider,
-                system_prompt="你是搜索助手",
-                user_prompt=prompt,
-                temperature=0.3,
-                json_mode=True
+            # 调用 LLM 理解上下文（相同历史+输入直接复用上次的解析结果，如界面重试/重复点击）
+            # 深拷贝一份，合并参数时不会改到缓存
+            intent_data = copy.deepcopy(
+                _contextual_intent(self.model_provider, history_text, user_input)
             )
             
-            intent_data = self._parse_json_response(response)
-            
             # 如果是细化搜索且有之前的参数，合并参数
             if intent_data.get('is_refinement') and self.last_search_params:
                 # 合并关键词
@@ -214,3 +203,22 @@ class ConversationalSearchAgent(FileSearchAgent):
                 'error': str(e),
                 'results': []
             }
+
+
+@functools.lru_cache(maxsize=256)
+def _contextual_intent(provider: str, history_text: str, user_input: str) -> Dict:
+    """上下文理解的 LLM 调用并解析；无法解析的回复直接抛出异常，不会进入缓存"""
+    from core.llm_helper import call_llm
+    
+    prompt = ConversationalSearchAgent.CONTEXTUAL_PROMPT.format(
+        history=history_text or "无",
+        current_input=user_input
+    )
+    response = call_llm(
+        provider=provider,
+        system_prompt="你是搜索助手",
+        user_prompt=prompt,
+        temperature=0.3,
+        json_mode=True
+    )
+    return ConversationalSearchAgent._parse_json_response(response)
@@ -2,13 +2,33 @@
 智能文件推荐
 基于文件关联、相似度、使用历史等推荐相关文件
 """
+import functools
+import heapq
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
+# 文件名拆词后不计入相似关键词的分隔符
+_SPLIT_NOISE = frozenset({'.', '_', '-'})
+
+
+@functools.lru_cache(maxsize=4096)
+def _as_path(raw_path: str) -> Path:
+    """路径字符串 -> Path，按字符串缓存，重复推荐/分组同一批文件时不再重复解析"""
+    return Path(raw_path)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_date(date_str: str) -> Optional[date]:
+    """ISO 时间字符串 -> 日期；无法解析时返回 None。大量文件共享同一时间字符串，按字符串缓存"""
+    try:
+        return datetime.fromisoformat(date_str.replace('Z', '+00:00')).date()
+    except ValueError:
+        return None
+
 
 class FileRecommender:
     """文件推荐器"""
@@ -36,17 +56,21 @@ class FileRecommender:
             推荐文件列表
         """
         try:
-            target_path = Path(target_file.get('path', ''))
-            target_name = target_file.get('name', '')
+            # 目标文件相关的值与循环无关，只计算一次
+            target_raw_path = target_file.get('path')
+            target_path = _as_path(target_raw_path or '')
             target_dir = target_path.parent
+            target_suffix = target_path.suffix
+            target_words = set(target_file.get('name', '').lower().split()) - _SPLIT_NOISE
             
             recommendations = []
             
             for file in all_files:
-                if file.get('path') == target_file.get('path'):
+                raw_path = file.get('path')
+                if raw_path == target_raw_path:
                     continue  # 跳过自己
                 
-                file_path = Path(file.get('path', ''))
+                file_path = _as_path(raw_path or '')
                 score = 0
                 reason = []
                 
@@ -56,15 +80,13 @@ class FileRecommender:
                     reason.append("同目录")
                 
                 # 2. 文件名包含相同关键词 (+30分)
-                target_words = set(target_name.lower().split())
-                file_words = set(file.get('name', '').lower().split())
-                common_words = target_words & file_words - {'.', '_', '-'}
-                if len(common_words) > 0:
+                common_words = target_words.intersection(file.get('name', '').lower().split()) if target_words else None
+                if common_words:
                     score += 30 * len(common_words)
                     reason.append(f"相似关键词: {', '.join(list(common_words)[:2])}")
                 
                 # 3. 相同文件类型 (+10分)
-                if file_path.suffix == target_path.suffix:
+                if file_path.suffix == target_suffix:
                     score += 10
                     reason.append("相同类型")
                 
@@ -75,10 +97,8 @@ class FileRecommender:
                         'recommendation_reason': ' • '.join(reason)
                     })
             
-            # 按评分排序
-            recommendations.sort(key=lambda x: x['recommendation_score'], reverse=True)
-            
-            return recommendations[:max_recommendations]
+            # 按评分取前 N 个（只做部分选择，同分保持原顺序）
+            return heapq.nlargest(max_recommendations, recommendations, key=lambda x: x['recommendation_score'])
             
         except Exception as e:
             logger.error(f"Failed to get related files: {e}")
@@ -101,7 +121,7 @@ class FileRecommender:
             groups = {}
             
             for file in files:
-                path = Path(file.get('path', ''))
+                path = _as_path(file.get('path', ''))
                 
                 # 尝试从路径提取主题
                 path_parts = path.parts
@@ -155,19 +175,18 @@ class FileRecommender:
                     groups["更早"].append(file)
                     continue
                 
-                try:
-                    # 尝试解析日期
-                    file_date = datetime.fromisoformat(date_str.replace('Z', '+00:00')).date()
-                    
-                    if file_date == today:
-                        groups["今天"].append(file)
-                    elif file_date >= week_ago:
-                        groups["本周"].append(file)
-                    elif file_date >= month_ago:
-                        groups["本月"].append(file)
-                    else:
-                        groups["更早"].append(file)
-                except:
+                # 尝试解析日期
+                file_date = _parse_date(date_str) if isinstance(date_str, str) else None
+                
+                if file_date is None:
+                    groups["更早"].append(file)
+                elif file_date == today:
+                    groups["今天"].append(file)
+                elif file_date >= week_ago:
+                    groups["本周"].append(file)
+                elif file_date >= month_ago:
+                    groups["本月"].append(file)
+                else:
                     groups["更早"].append(file)
             
             # 移除空组
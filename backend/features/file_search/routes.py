@@ -3,10 +3,12 @@
 提供 RESTful API 端点
 """
 import logging
-from flask import Blueprint, request, jsonify, send_file, Response, stream_with_context
+from flask import Blueprint, request, jsonify, send_file, Response, stream_with_context, current_app
 import os
-import json
+import threading
+import time
 import requests
+from collections import OrderedDict
 from urllib.parse import unquote, quote
 from features.file_search.services import FileSearchService
 from features.file_search.search_agent import FileSearchAgent
@@ -20,6 +22,72 @@ file_search_bp = Blueprint('file_search', __name__)
 search_service = FileSearchService()
 search_agent = FileSearchAgent()
 
+# 本模块的 POST 请求体只含查询参数或路径，超过上限直接 413，不再读取和解析
+_MAX_QUERY_BODY = 64 * 1024
+_MAX_PATH_BODY = 4 * 1024
+_PATH_BODY_ENDPOINTS = frozenset({'file_search.open_file_location'})
+
+
+@file_search_bp.before_request
+def _reject_oversized_body():
+    length = request.content_length
+    if length is None:
+        return None
+    limit = _MAX_PATH_BODY if request.endpoint in _PATH_BODY_ENDPOINTS else _MAX_QUERY_BODY
+    if length > limit:
+        return jsonify({'success': False, 'error': '请求体过大'}), 413
+    return None
+
+
+class _TTLCache:
+    """线程安全的 LRU + TTL 缓存；文件系统随时在变，条目过期后重新检索"""
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (写入时间, 值)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+# /smart 结果缓存：同一查询（规范化后）与参数在 TTL 内直接回放上次的 NDJSON 事件流，跳过 LLM 与 Everything 检索
+_smart_cache = _TTLCache(ttl=300, maxsize=128)
+# 不含 AI 的检索（/quick-search、关闭 AI 排序的 /search）结果确定，短时间内重复请求（刷新、重试）直接复用
+_search_cache = _TTLCache(ttl=60, maxsize=512)
+
+
+def _smart_cache_key(query, model_provider, model_config, max_results, max_candidates) -> tuple:
+    """大小写、多余空白不同的查询视为同一查询；不同模型的结果分开缓存"""
+    model = model_config.get('model') if isinstance(model_config, dict) else None
+    return (" ".join(query.lower().split()), model_provider, model, max_results, max_candidates)
+
+
+def _cached_search(key, search):
+    """执行 search() 并缓存成功结果；缓存的 dict 只会被 jsonify 序列化，不会被修改"""
+    result = _search_cache.get(key)
+    if result is None:
+        result = search()
+        if result.get('success'):
+            _search_cache.put(key, result)
+    return result
+
 
 @file_search_bp.route('/smart', methods=['POST'])
 def smart_search():
@@ -30,7 +98,7 @@ def smart_search():
         NDJSON stream (application/x-ndjson)
     """
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True, cache=False)
         if not data:
             return jsonify({'success': False, 'error': '请求体不能为空'}), 400
         
@@ -43,10 +111,18 @@ def smart_search():
         model_config = data.get('modelConfig', None)
         max_candidates = min(data.get('maxCandidates', 2000), 10000)
         
+        cache_key = _smart_cache_key(query, model_provider, model_config, max_results, max_candidates)
+        cached_lines = _smart_cache.get(cache_key)
+        if cached_lines is not None:
+            logger.info(f"AI Smart search (Cached): query='{query}'")
+            return Response(cached_lines, mimetype='application/x-ndjson', headers={'X-Cache': 'HIT'})
+        
         logger.info(f"AI Smart search (Stream): query='{query}'")
         
         def generate():
             agent = FileSearchAgent(model_provider=model_provider, model_config=model_config)
+            lines = []
+            has_final = False
             try:
                 # 调用生成器
                 for event in agent.smart_search(
@@ -55,14 +131,26 @@ def smart_search():
                     max_candidates=max_candidates,
                     top_k=max_results
                 ):
-                    # 将事件序列化为 JSON 行
-                    yield json.dumps(event, ensure_ascii=False) + '\n'
+                    # 将事件序列化为 JSON 行（app.json 为 orjson，直接输出 UTF-8 中文）
+                    line = current_app.json.dumps(event) + '\n'
+                    lines.append(line)
+                    yield line
+                    
+                    event_type = event.get('type')
+                    if event_type == 'error':
+                        return
+                    if event_type == 'final_results':
+                        has_final = True
             except Exception as e:
                 logger.error(f"Stream error: {e}")
-                yield json.dumps({"type": "error", "message": str(e)}, ensure_ascii=False) + '\n'
+                yield current_app.json.dumps({"type": "error", "message": str(e)}) + '\n'
+                return
+            
+            # 只缓存完整跑完且给出精选结果的流（客户端中途断开时生成器被关闭，不会走到这里）
+            if has_final:
+                _smart_cache.put(cache_key, lines)
         
-        from flask import Response, stream_with_context
-        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers={'X-Cache': 'MISS'})
 
     except Exception as e:
         logger.error(f"Smart search error: {e}", exc_info=True)
@@ -103,7 +191,7 @@ def search_files():
     """
     try:
         # 解析请求参数
-        data = request.get_json()
+        data = request.get_json(silent=True, cache=False)
         
         if not data:
             return jsonify({
@@ -130,13 +218,20 @@ def search_files():
         # 执行搜索
         logger.info(f"File search request: query='{query}', types={file_types}")
         
-        result = search_service.smart_search(
-            query=query,
-            file_types=file_types,
-            date_range=date_range,
-            max_results=max_results,
-            enable_ai_ranking=enable_ai_ranking
-        )
+        def search():
+            return search_service.smart_search(
+                query=query,
+                file_types=file_types,
+                date_range=date_range,
+                max_results=max_results,
+                enable_ai_ranking=enable_ai_ranking
+            )
+        
+        if enable_ai_ranking:
+            result = search()
+        else:
+            types_key = tuple(file_types) if isinstance(file_types, list) else file_types
+            result = _cached_search(('search', query, types_key, date_range, max_results), search)
         
         # 返回结果
         if result['success']:
@@ -175,7 +270,10 @@ def quick_search():
         if max_results > 100:
             max_results = 100
         
-        result = search_service.quick_search(query, max_results)
+        result = _cached_search(
+            ('quick', query, max_results),
+            lambda: search_service.quick_search(query, max_results)
+        )
         
         return jsonify(result), 200 if result['success'] else 500
     
@@ -199,7 +297,7 @@ def search_documents():
     }
     """
     try:
-        data = request.get_json() or {}
+        data = request.get_json(silent=True, cache=False) or {}
         query = data.get('query', '').strip()
         
         if not query:
@@ -233,7 +331,7 @@ def search_spreadsheets():
     }
     """
     try:
-        data = request.get_json() or {}
+        data = request.get_json(silent=True, cache=False) or {}
         query = data.get('query', '').strip()
         
         if not query:
@@ -266,7 +364,7 @@ def open_file_location():
     }
     """
     try:
-        data = request.get_json() or {}
+        data = request.get_json(silent=True, cache=False) or {}
         path = data.get('path', '').strip()
         
         if not path:
@@ -298,11 +396,12 @@ def download_file():
         if not path:
             return jsonify({'success': False, 'error': 'Path is required'}), 400
             
-        if not os.path.exists(path):
+        # send_file 自身会 stat 一次（取大小、修改时间），文件不存在时直接抛出，不再额外 exists 检查
+        try:
+            return send_file(path, as_attachment=True)
+        except FileNotFoundError:
             return jsonify({'success': False, 'error': 'File not found'}), 404
             
-        return send_file(path, as_attachment=True)
-            
     except Exception as e:
         logger.error(f"Download error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -319,7 +418,7 @@ def copy_text():
     }
     """
     try:
-        data = request.get_json() or {}
+        data = request.get_json(silent=True, cache=False) or {}
         text = data.get('text') or data.get('path', '')
         text = str(text).strip()
         
@@ -247,7 +247,8 @@ class FileSearchAgent:
             })
         return fallback_results
     
-    def _parse_json_response(self, response: str) -> Dict:
+    @staticmethod
+    def _parse_json_response(response: str) -> Dict:
         """解析 JSON"""
         try:
             cleaned = response.strip()
@@ -5,7 +5,7 @@ Integrates with existing INF5 features to provide unified functionality for Open
 """
 import io
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, IO, Optional
 from features.canvas_converter import tiptap_to_docx, docx_to_tiptap, tiptap_to_smart_docx
 from features.agent_anything.services import chat_with_anything, generate_content_with_knowledge, perform_anything_audit
 from .session_manager import session_manager
@@ -53,7 +53,7 @@ class RemoteControlService:
             raise
     
     @staticmethod
-    def export_docx(doc_id: str, format_type: str = 'standard') -> io.BytesIO:
+    def export_docx(doc_id: str, format_type: str = 'standard') -> IO[bytes]:
         """
         Export a document as DOCX.
         
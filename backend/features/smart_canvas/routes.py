@@ -1,10 +1,14 @@
 from flask import Blueprint, request, jsonify, current_app
 import logging
 import os
+import tempfile
 from core.services import current_engine
 
 smart_canvas_bp = Blueprint('smart_canvas', __name__)
 
+# Deletes markdown '*' and '#' in a single pass
+_MD_STRIP_TABLE = str.maketrans('', '', '*#')
+
 @smart_canvas_bp.route('/upload', methods=['POST'])
 def smart_canvas_upload():
     try:
@@ -77,7 +81,7 @@ def transfer_to_canvas():
             if stripped_line.startswith('!['):
                 continue
 
-            clean_text = stripped_line.replace('*', '').replace('#', '').strip()
+            clean_text = stripped_line.translate(_MD_STRIP_TABLE).strip()
             
             p = doc.add_paragraph()
             p.paragraph_format.line_spacing = Pt(28)
@@ -135,7 +139,6 @@ def smart_canvas_export():
         from docx.shared import Pt, Cm
         from docx.enum.text import WD_ALIGN_PARAGRAPH
         from docx.oxml.ns import qn
-        import io
         import re
         from flask import send_file
         
@@ -164,7 +167,7 @@ def smart_canvas_export():
             if stripped_line.startswith('!['):
                 continue
 
-            clean_text = stripped_line.replace('*', '').replace('#', '').strip()
+            clean_text = stripped_line.translate(_MD_STRIP_TABLE).strip()
             
             p = doc.add_paragraph()
             p.paragraph_format.line_spacing = Pt(28)
@@ -192,12 +195,25 @@ def smart_canvas_export():
                     run = p.add_run(clean_text)
                     set_font(run, '仿宋_GB2312', 16)
 
-        # 2. Save to stream
-        f = io.BytesIO()
-        doc.save(f)
-        f.seek(0)
-        
-        return send_file(f, as_attachment=True, download_name='co_creation_export.docx', mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
+        # 2. Save to a temp file and send it by path (lets the server use sendfile
+        #    instead of holding the whole DOCX in memory); removed once sent
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
+            tmp_path = tmp.name
+
+        def _cleanup():
+            try:
+                os.unlink(tmp_path)
+            except OSError as e:
+                logging.warning(f"Failed to remove temp export {tmp_path}: {e}")
+
+        try:
+            doc.save(tmp_path)
+            response = send_file(tmp_path, as_attachment=True, download_name='co_creation_export.docx', mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
+        except Exception:
+            _cleanup()
+            raise
+        response.call_on_close(_cleanup)
+        return response
 
     except Exception as e:
         logging.error(f"Export Error: {e}")
@@ -392,6 +392,7 @@ class SmartFillerService:
         
         self._log_debug(f"Filled {rows_added} rows.")
         
+        current_engine.touch()
         # Save the modified document
         if current_engine.original_path:
              current_engine.doc.save(current_engine.original_path)
@@ -451,6 +452,7 @@ class SmartFillerService:
                 
                 if target_cell_idx < len(row.cells):
                     row.cells[target_cell_idx].text = str(text)
+                    current_engine.touch()
                     if current_engine.original_path:
                         current_engine.doc.save(current_engine.original_path)
                     return f"Written '{text}' to Table {t_idx}, Row {r_idx}, Cell {target_cell_idx}"
@@ -463,6 +465,7 @@ class SmartFillerService:
                 p_idx = int(location.split(" ")[1])
                 para = current_engine.doc.paragraphs[p_idx]
                 para.add_run(f" {text}")
+                current_engine.touch()
                 if current_engine.original_path:
                     current_engine.doc.save(current_engine.original_path)
                 return f"Appended '{text}' to Paragraph {p_idx}"
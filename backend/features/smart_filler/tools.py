@@ -226,6 +226,7 @@ class ToolRegistry:
                         current_engine.doc.save(current_engine.original_path)
                     
                     # Signal Update
+                    current_engine.touch()
                     if hasattr(self.context, 'events'):
                         self.context.events.append({"type": "CANVAS_UPDATE"})
                         
@@ -246,6 +247,7 @@ class ToolRegistry:
                     logger.warning("Tool write failed to save: No original_path")
                 
                 # Signal Update
+                current_engine.touch()
                 if hasattr(self.context, 'events'):
                     self.context.events.append({"type": "CANVAS_UPDATE"})
 
@@ -338,6 +340,7 @@ class ToolRegistry:
                         target_doc.save(current_engine.original_path)
                     
                     # Signal Update
+                    current_engine.touch()
                     if hasattr(self.context, 'events'):
                         self.context.events.append({"type": "CANVAS_UPDATE"})
 
@@ -357,6 +360,7 @@ class ToolRegistry:
                     target_doc.save(current_engine.original_path)
 
                 # Signal Update
+                current_engine.touch()
                 if hasattr(self.context, 'events'):
                     self.context.events.append({"type": "CANVAS_UPDATE"})
 
@@ -550,6 +554,7 @@ class ToolRegistry:
                     log_debug("Document Reloaded from Disk.")
                     
                     # Signal Frontend to Refresh
+                    current_engine.touch()
                     if hasattr(self.context, 'events'):
                         self.context.events.append({"type": "CANVAS_UPDATE"})
 
@@ -591,6 +596,7 @@ class ToolRegistry:
                         current_engine.doc = new_doc
                         
                     # Signal Frontend
+                    current_engine.touch()
                     if hasattr(self.context, 'events'):
                         self.context.events.append({"type": "CANVAS_UPDATE"})
                         
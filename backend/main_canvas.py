@@ -88,7 +88,7 @@ async def chat_with_doc(message: Dict[str, Any] = Body(...)):
     if intent == "MODIFY":
         if code:
             # Execute Code on STAGING
-            success, error_msg = current_engine.execute_code(code)
+            success, error_msg, _ = current_engine.execute_code(code)
             
             if not success:
                  # If execution fails, return error in reply and downgrade to CHAT
@@ -167,7 +167,7 @@ async def format_official_doc(data: Dict[str, Any] = Body(...)):
     code = llm_engine.generate_formatting_code(context, model_config, scope)
     
     # Execute Code on STAGING
-    success, error_msg = current_engine.execute_code(code)
+    success, error_msg, _ = current_engine.execute_code(code)
     
     if not success:
          raise HTTPException(status_code=400, detail=f"Failed to execute formatting code: {error_msg}")
@@ -204,7 +204,7 @@ async def modify_local_doc(data: Dict[str, Any] = Body(...)):
         # But load_from_path clears staging.
         # So execute_code will use self.doc.
         
-        success, error_msg = current_engine.execute_code(code)
+        success, error_msg, _ = current_engine.execute_code(code)
         if not success:
              raise HTTPException(status_code=500, detail=f"Failed to execute AI code: {error_msg}")
         
@@ -0,0 +1,49 @@
+"""
+Reference retrieval: TOC items from get_reference_structure (id/end_id)
+must be accepted by get_content_by_indices, as /chat passes title matches
+straight through.
+"""
+import pytest
+
+docx = pytest.importorskip("docx")
+
+from core.docx_engine import DocxEngine
+
+
+def _engine_with_reference():
+    ref = docx.Document()
+    ref.add_heading("第一章 总则", level=1)
+    ref.add_paragraph("本办法适用于全体员工。")
+    ref.add_heading("第二章 安全要求", level=1)
+    ref.add_paragraph("进入机房须佩戴工牌。")
+
+    engine = DocxEngine()
+    engine.reference_docs.append({
+        "uid": 1,
+        "filename": "ref.docx",
+        "type": "docx",
+        "doc": ref,
+        "markdown": None,
+    })
+    return engine
+
+
+def test_toc_items_retrieve_section_text():
+    engine = _engine_with_reference()
+    toc = engine.get_reference_structure()
+    match = [item for item in toc if item["title"] == "第二章 安全要求"]
+    assert match and "start" not in match[0]
+
+    context = engine.get_content_by_indices(match)
+
+    assert "章节：第二章 安全要求" in context
+    assert "进入机房须佩戴工牌。" in context
+    assert "本办法适用于全体员工。" not in context
+
+
+def test_llm_style_start_end_items_still_supported():
+    engine = _engine_with_reference()
+
+    context = engine.get_content_by_indices([{"start": 0, "end": 1, "doc_idx": 0, "title": "总则"}])
+
+    assert "本办法适用于全体员工。" in context
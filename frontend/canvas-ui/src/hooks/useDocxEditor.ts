@@ -60,7 +60,8 @@ export const useDocxEditor = () => {
             const assistantMsg = { role: 'assistant', content: res.data.reply } as const;
 
             updateState({
-                previewData: res.data.preview || [],
+                // Non-MODIFY turns omit `preview`: keep showing the current document
+                previewData: res.data.preview ?? state.previewData,
                 isPendingConfirmation: res.data.intent === 'MODIFY',
                 messages: [...state.messages, userMsg, assistantMsg]
             });
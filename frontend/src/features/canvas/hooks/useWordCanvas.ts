@@ -226,11 +226,10 @@ export const useWordCanvas = () => {
         if (state.isProcessing) return;
         updateState({ isProcessing: true });
         try {
-            const res = await axios.post(`${API_URL}/confirm`);
-            updateState({
-                htmlPreview: res.data.html_preview, // Real-time update
-                isPendingConfirmation: false
-            });
+            // The response only renders page 1; reload the page the user is on instead
+            await axios.post(`${API_URL}/confirm`, { include_html: false });
+            updateState({ isPendingConfirmation: false });
+            await loadPage(state.page);
         } catch (error) {
             console.error("Confirm failed", error);
             alert("确认修改失败");
@@ -243,11 +242,9 @@ export const useWordCanvas = () => {
         if (state.isProcessing) return;
         updateState({ isProcessing: true });
         try {
-            const res = await axios.post(`${API_URL}/discard`);
-            updateState({
-                htmlPreview: res.data.html_preview, // Real-time revert
-                isPendingConfirmation: false
-            });
+            await axios.post(`${API_URL}/discard`, { include_html: false });
+            updateState({ isPendingConfirmation: false });
+            await loadPage(state.page);
         } catch (error) {
             console.error("Discard failed", error);
             alert("取消修改失败");
@@ -285,17 +282,16 @@ export const useWordCanvas = () => {
     const handleFormat = async (modelConfig: ModelConfig, scope: 'all' | 'layout' | 'body' = 'all', processor: 'local' | 'ai' = 'local', forceUnbold: boolean = false) => {
         updateState({ isProcessing: true });
         try {
-            const res = await axios.post(`${API_URL}/format_official`, {
+            await axios.post(`${API_URL}/format_official`, {
                 model_config: modelConfig,
                 scope,
                 processor,
-                force_unbold: forceUnbold
+                force_unbold: forceUnbold,
+                include_html: false
             });
 
-            updateState({
-                htmlPreview: res.data.html_preview,
-                isPendingConfirmation: true,
-            });
+            updateState({ isPendingConfirmation: true });
+            await loadPage(state.page);
 
         } catch (error) {
             console.error("Format failed", error);